@@ -1,17 +1,24 @@
 from __future__ import annotations
 
-import json
+import os
+import threading
+from collections import deque
 from contextlib import contextmanager
-from copy import deepcopy
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Iterator, List
+from typing import Any, Deque, Dict, Iterable, Iterator, List
 from uuid import uuid4
 
+import orjson
 from pydantic import BaseModel, Field
 
 from .data_loader import DATA_DIR
 
 STATE_PATH = DATA_DIR / "agent_state.json"
+OBSERVABILITY_PATH = DATA_DIR / "observability.jsonl"
+OBSERVABILITY_MAX_ENTRIES = 200
+# Trim the log back to OBSERVABILITY_MAX_ENTRIES once it passes this size.
+OBSERVABILITY_COMPACT_BYTES = 256 * 1024
 SCHEMA_VERSION = 1
 
 try:
@@ -20,23 +27,16 @@ except ImportError:  # pragma: no cover - Windows fallback
     fcntl = None
 
 
-class ObservabilityEvent(BaseModel):
-    event_id: str
-    created_at: str
-    mode: str
-    model: str | None = None
-    message: str | None = None
-    student_id: str | None = None
-    intents: Dict[str, bool] = Field(default_factory=dict)
-    signals: Dict[str, bool] = Field(default_factory=dict)
-    tools_called: List[str] = Field(default_factory=list)
-    filters: Dict[str, Any] = Field(default_factory=dict)
-    counts: Dict[str, int] = Field(default_factory=dict)
-    token_usage: Dict[str, int] = Field(default_factory=dict)
-    cost_estimate: Dict[str, float] = Field(default_factory=dict)
+def _dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+
+
+def _dumps_line(obj: Any) -> bytes:
+    return orjson.dumps(obj) + b"\n"
 
-    class Config:
-        extra = "ignore"
+
+def _loads(payload: bytes) -> Any:
+    return orjson.loads(payload)
 
 
 class AgentState(BaseModel):
@@ -45,7 +45,7 @@ class AgentState(BaseModel):
     holds: List[Dict[str, Any]] = Field(default_factory=list)
     feedback: List[Dict[str, Any]] = Field(default_factory=list)
     chat_sessions: Dict[str, List[Dict[str, str]]] = Field(default_factory=dict)
-    observability: List[ObservabilityEvent] = Field(default_factory=list)
+    counters: Dict[str, int] = Field(default_factory=dict)
 
     class Config:
         extra = "ignore"
@@ -57,126 +57,314 @@ def _validate_state(data: Dict[str, Any]) -> AgentState:
     return AgentState.parse_obj(data)
 
 
-def _validate_event(data: Dict[str, Any]) -> ObservabilityEvent:
-    if hasattr(ObservabilityEvent, "model_validate"):
-        return ObservabilityEvent.model_validate(data)
-    return ObservabilityEvent.parse_obj(data)
-
-
 def _dump_model(model: BaseModel) -> Dict[str, Any]:
     if hasattr(model, "model_dump"):
         return model.model_dump()
     return model.dict()
 
 
-def _default_state() -> Dict[str, Any]:
-    return _dump_model(AgentState())
-
-
-DEFAULT_STATE: Dict[str, Any] = _default_state()
-
-
-def _parse_state_payload(payload: str) -> Dict[str, Any]:
+def _event_record(event: Dict[str, Any]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {
+        "model": None,
+        "message": None,
+        "student_id": None,
+        "intents": {},
+        "signals": {},
+        "tools_called": [],
+        "filters": {},
+        "counts": {},
+        "token_usage": {},
+        "cost_estimate": {},
+    }
+    record.update(event)
+    return record
+
+
+def _fresh_default_state() -> Dict[str, Any]:
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "onboarding_profiles": {},
+        "holds": [],
+        "feedback": [],
+        "chat_sessions": {},
+        "counters": {},
+    }
+
+
+def _parse_state_payload(payload: bytes) -> Dict[str, Any]:
     if not payload.strip():
-        return deepcopy(DEFAULT_STATE)
+        return _fresh_default_state()
     try:
-        data = json.loads(payload)
-    except json.JSONDecodeError:
-        return deepcopy(DEFAULT_STATE)
+        data = _loads(payload)
+    except ValueError:
+        return _fresh_default_state()
 
     if not isinstance(data, dict):
-        return deepcopy(DEFAULT_STATE)
+        return _fresh_default_state()
+
+    legacy_events = data.get("observability")
+    if isinstance(legacy_events, list) and legacy_events:
+        _migrate_observability(legacy_events)
 
+    # load_state() caches the result until the file changes, so full
+    # validation only runs on a cold read.
     try:
         state = _validate_state(data)
     except Exception:
-        return deepcopy(DEFAULT_STATE)
+        return _fresh_default_state()
     state.schema_version = SCHEMA_VERSION
     return _dump_model(state)
 
 
 @contextmanager
-def _locked_state_file() -> Iterator[Any]:
-    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    handle = STATE_PATH.open("a+", encoding="utf-8")
+def _locked_file(path: Path) -> Iterator[Any]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    handle = os.fdopen(fd, "r+b")
     try:
         if fcntl is not None:
-            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
-        handle.seek(0)
+            fcntl.flock(fd, fcntl.LOCK_EX)
         yield handle
     finally:
         if fcntl is not None:
-            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            fcntl.flock(fd, fcntl.LOCK_UN)
         handle.close()
 
 
-def load_state() -> Dict[str, Any]:
-    if not STATE_PATH.exists():
-        return deepcopy(DEFAULT_STATE)
+def _read_locked(path: Path) -> bytes | None:
     try:
-        with STATE_PATH.open("r", encoding="utf-8") as handle:
+        with path.open("rb") as handle:
             if fcntl is not None:
                 fcntl.flock(handle.fileno(), fcntl.LOCK_SH)
-            payload = handle.read()
-            if fcntl is not None:
-                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            return handle.read()
     except OSError:
-        return deepcopy(DEFAULT_STATE)
+        return None
+
 
-    return _parse_state_payload(payload)
+class _StateCache:
+    """Process-wide copy of the parsed state, invalidated when the file changes."""
+
+    def __init__(self) -> None:
+        self.data: Dict[str, Any] | None = None
+        self.stamp: tuple[int, int, int] | None = None
+        self.lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.data = None
+            self.stamp = None
+
+
+_state_cache = _StateCache()
+
+
+def _file_stamp(st: os.stat_result) -> tuple[int, int, int]:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def load_state() -> Dict[str, Any]:
+    """Return the shared state dict, re-reading the file only when it changed.
+
+    Callers that mutate the result must persist it with save_state().
+    """
+    try:
+        stamp = _file_stamp(os.stat(STATE_PATH))
+    except OSError:
+        return _fresh_default_state()
+    with _state_cache.lock:
+        if _state_cache.data is not None and _state_cache.stamp == stamp:
+            return _state_cache.data
+    payload = _read_locked(STATE_PATH)
+    if payload is None:
+        return _fresh_default_state()
+    data = _parse_state_payload(payload)
+    with _state_cache.lock:
+        _state_cache.data = data
+        _state_cache.stamp = stamp
+    return data
 
 
 def save_state(state: Dict[str, Any] | AgentState) -> None:
-    if isinstance(state, AgentState):
-        state_model = state
-    else:
-        state_model = _validate_state(state)
-    state_model.schema_version = SCHEMA_VERSION
-    payload = json.dumps(_dump_model(state_model), indent=2, sort_keys=True)
+    data = _dump_model(state) if isinstance(state, AgentState) else state
+    data["schema_version"] = SCHEMA_VERSION
+    # Underscore keys hold in-memory indices derived from the persisted data.
+    payload = _dumps({key: value for key, value in data.items() if not key.startswith("_")})
 
-    with _locked_state_file() as handle:
-        handle.seek(0)
-        handle.truncate()
-        handle.write(payload)
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = STATE_PATH.with_name(f"{STATE_PATH.name}.{uuid4().hex[:8]}.tmp")
+    try:
+        with tmp_path.open("wb") as handle:
+            handle.write(payload)
+            handle.flush()
+            os.fsync(handle.fileno())
+            stamp = _file_stamp(os.fstat(handle.fileno()))
+        os.replace(tmp_path, STATE_PATH)
+    except BaseException:
+        _state_cache.invalidate()
+        raise
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    with _state_cache.lock:
+        _state_cache.data = data
+        _state_cache.stamp = stamp
+
+
+@dataclass(slots=True)
+class HoldIndex:
+    holds: List[Dict[str, Any]]
+    size: int
+    by_id: Dict[str, Dict[str, Any]]
+    by_student: Dict[str, List[Dict[str, Any]]]
+
+
+def hold_index(state: Dict[str, Any]) -> HoldIndex:
+    """Return the in-memory hold lookup for state, rebuilding it if stale."""
+    holds = state.setdefault("holds", [])
+    index = state.get("_hold_index")
+    if index is None or index.holds is not holds or index.size != len(holds):
+        by_id: Dict[str, Dict[str, Any]] = {}
+        by_student: Dict[str, List[Dict[str, Any]]] = {}
+        for hold in holds:
+            by_id.setdefault(hold.get("hold_id", ""), hold)
+            by_student.setdefault(hold.get("student_id", ""), []).append(hold)
+        index = HoldIndex(holds=holds, size=len(holds), by_id=by_id, by_student=by_student)
+        state["_hold_index"] = index
+    return index
+
+
+def add_hold(state: Dict[str, Any], hold: Dict[str, Any]) -> None:
+    index = hold_index(state)
+    index.holds.append(hold)
+    index.size += 1
+    index.by_id.setdefault(hold.get("hold_id", ""), hold)
+    index.by_student.setdefault(hold.get("student_id", ""), []).append(hold)
+
+
+@dataclass(slots=True)
+class FeedbackIndex:
+    feedback: List[Dict[str, Any]]
+    size: int
+    # book_id -> [rating sum, rating count]
+    rating_stats: Dict[str, List[int]]
+
+
+def _index_rating(rating_stats: Dict[str, List[int]], entry: Dict[str, Any]) -> None:
+    book_id = entry.get("book_id")
+    rating = entry.get("rating")
+    if book_id and rating is not None:
+        stats = rating_stats.setdefault(book_id, [0, 0])
+        stats[0] += rating
+        stats[1] += 1
+
+
+def feedback_index(state: Dict[str, Any]) -> FeedbackIndex:
+    """Return the in-memory per-book rating stats for state, rebuilding them if stale."""
+    feedback = state.setdefault("feedback", [])
+    index = state.get("_feedback_index")
+    if index is None or index.feedback is not feedback or index.size != len(feedback):
+        rating_stats: Dict[str, List[int]] = {}
+        for entry in feedback:
+            _index_rating(rating_stats, entry)
+        index = FeedbackIndex(feedback=feedback, size=len(feedback), rating_stats=rating_stats)
+        state["_feedback_index"] = index
+    return index
+
+
+def add_feedback(state: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    index = feedback_index(state)
+    index.feedback.append(entry)
+    index.size += 1
+    _index_rating(index.rating_stats, entry)
 
 
 def new_event_id() -> str:
     return f"EVT-{uuid4().hex[:10]}"
 
 
-def record_observability(event: Dict[str, Any], *, max_entries: int = 200) -> None:
-    with _locked_state_file() as handle:
-        payload = handle.read()
-        state = _parse_state_payload(payload)
-        events = state.get("observability", [])
-        events.append(_dump_model(_validate_event(event)))
-        if len(events) > max_entries:
-            events = events[-max_entries:]
-        state["observability"] = events
-        handle.seek(0)
-        handle.truncate()
-        handle.write(json.dumps(state, indent=2, sort_keys=True))
+def _parse_event_lines(lines: Iterable[bytes]) -> List[Dict[str, Any]]:
+    events: List[Dict[str, Any]] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            event = _loads(line)
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            events.append(event)
+    return events
+
+
+def _rewrite_events(handle: Any, events: List[Dict[str, Any]]) -> None:
+    handle.seek(0)
+    handle.truncate()
+    handle.write(b"".join(_dumps_line(event) for event in events))
+
+
+def _migrate_observability(legacy_events: List[Any]) -> None:
+    """Move events from an old agent_state.json "observability" array into the log.
+
+    Events already in the log (by event_id) are skipped, so a state file that
+    is read again before its next save does not duplicate them.
+    """
+    with _locked_file(OBSERVABILITY_PATH) as handle:
+        events = _parse_event_lines(handle)
+        seen = {event.get("event_id") for event in events}
+        missing = [
+            _event_record(event)
+            for event in legacy_events
+            if isinstance(event, dict) and event.get("event_id") not in seen
+        ]
+        if missing:
+            # Legacy events predate anything already appended to the log.
+            _rewrite_events(handle, missing + events)
+
+
+def _compact_observability(handle: Any, max_entries: int) -> None:
+    handle.seek(0)
+    tail: Deque[bytes] = deque(maxlen=max_entries)
+    for line in handle:
+        if line.strip():
+            tail.append(line)
+    # Leave headroom below the trigger so large events cannot force a
+    # compaction on every append.
+    size = sum(len(line) for line in tail)
+    while len(tail) > 1 and size > OBSERVABILITY_COMPACT_BYTES // 2:
+        size -= len(tail.popleft())
+    handle.seek(0)
+    handle.truncate()
+    handle.write(b"".join(tail))
+
+
+def load_observability(max_entries: int = OBSERVABILITY_MAX_ENTRIES) -> List[Dict[str, Any]]:
+    """Return the newest max_entries events, oldest first."""
+    payload = _read_locked(OBSERVABILITY_PATH)
+    if not payload:
+        return []
+    lines = [line for line in payload.splitlines() if line.strip()]
+    return _parse_event_lines(lines[-max_entries:])
+
+
+def record_observability(
+    event: Dict[str, Any], *, max_entries: int = OBSERVABILITY_MAX_ENTRIES
+) -> None:
+    line = _dumps_line(_event_record(event))
+    with _locked_file(OBSERVABILITY_PATH) as handle:
+        handle.seek(0, os.SEEK_END)
+        handle.write(line)
+        # Sized from the file itself, so every process sees the same trigger.
+        if handle.tell() > OBSERVABILITY_COMPACT_BYTES:
+            _compact_observability(handle, max_entries)
 
 
 def update_observability(event_id: str, updates: Dict[str, Any]) -> bool:
     if not event_id:
         return False
-    with _locked_state_file() as handle:
-        payload = handle.read()
-        state = _parse_state_payload(payload)
-        events = state.get("observability", [])
-        updated = False
-        for idx, event in enumerate(events):
-            if event.get("event_id") == event_id:
-                merged = dict(event)
-                merged.update(updates)
-                events[idx] = _dump_model(_validate_event(merged))
-                updated = True
-                break
-        if not updated:
-            return False
-        state["observability"] = events
-        handle.seek(0)
-        handle.truncate()
-        handle.write(json.dumps(state, indent=2, sort_keys=True))
-        return True
+    with _locked_file(OBSERVABILITY_PATH) as handle:
+        events = _parse_event_lines(handle)
+        for idx in range(len(events) - 1, -1, -1):
+            if events[idx].get("event_id") == event_id:
+                events[idx] = {**events[idx], **updates}
+                _rewrite_events(handle, events)
+                return True
+        return False
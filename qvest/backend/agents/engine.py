@@ -1,15 +1,19 @@
 from __future__ import annotations
 
+import heapq
 import json
-from dataclasses import asdict, dataclass
+from dataclasses import dataclass
+from enum import IntFlag, auto
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Literal
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Literal, Mapping, Tuple
 
 from ..agent_state import load_state, new_event_id, record_observability, save_state
 from ..chat_utils import build_recommendations, extract_student_id, wants_recommendations
 from ..data_loader import DATA_DIR
-from ..scoring import score_book
-from ..tools import action_detect, call_tool, signal_detect
+from ..scoring import Catalog, filter_rows, score_catalog
+from ..tools import call_tool, detect_actions, signal_detect
 from .utils import (
     build_continuation_recommendations,
     default_reason,
@@ -19,68 +23,110 @@ from .utils import (
 )
 
 
-@dataclass(frozen=True)
+class Intent(IntFlag):
+    AVAILABILITY = auto()
+    READING_HISTORY = auto()
+    SERIES_AUTHOR = auto()
+    STUDENT_SNAPSHOT = auto()
+    RESERVE_HOLD = auto()
+    ONBOARD_FROM_HISTORY = auto()
+    RECOMMENDATIONS = auto()
+
+
+class Signal(IntFlag):
+    ONBOARD_SAVE_INTENT = auto()
+    PROFILE_QUERY = auto()
+
+
+INTENT_FLAGS: Mapping[str, Intent] = MappingProxyType({
+    "availability": Intent.AVAILABILITY,
+    "reading_history": Intent.READING_HISTORY,
+    "series_author": Intent.SERIES_AUTHOR,
+    "student_snapshot": Intent.STUDENT_SNAPSHOT,
+    "reserve_hold": Intent.RESERVE_HOLD,
+    "onboard_from_history": Intent.ONBOARD_FROM_HISTORY,
+    "recommendations": Intent.RECOMMENDATIONS,
+})
+
+SIGNAL_FLAGS: Mapping[str, Signal] = MappingProxyType({
+    "onboard_save_intent": Signal.ONBOARD_SAVE_INTENT,
+    "profile_query": Signal.PROFILE_QUERY,
+})
+
+
+def _intent_mask(intents: Dict[str, bool]) -> Intent:
+    mask = Intent(0)
+    for name, enabled in intents.items():
+        if enabled and name in INTENT_FLAGS:
+            mask |= INTENT_FLAGS[name]
+    return mask
+
+
+def _signal_mask(signals: Dict[str, bool]) -> Signal:
+    mask = Signal(0)
+    for name, enabled in signals.items():
+        if enabled and name in SIGNAL_FLAGS:
+            mask |= SIGNAL_FLAGS[name]
+    return mask
+
+
+@dataclass(frozen=True, slots=True)
 class AgentCapabilities:
     mode: Literal["chat", "concierge"]
-    intents: Dict[str, bool]
-    signals: Dict[str, bool]
+    intent_mask: Intent
+    signal_mask: Signal
     use_filters: bool
     availability_limit: int
     recommendation_style: Literal["chat", "concierge"]
 
+    @property
+    def intents(self) -> Dict[str, bool]:
+        return {name: bool(self.intent_mask & flag) for name, flag in INTENT_FLAGS.items()}
+
+    @property
+    def signals(self) -> Dict[str, bool]:
+        return {name: bool(self.signal_mask & flag) for name, flag in SIGNAL_FLAGS.items()}
+
 
 CAPABILITIES_PATH = DATA_DIR / "agent_capabilities.json"
 
-DEFAULT_CAPABILITIES: Dict[str, AgentCapabilities] = {
+DEFAULT_CAPABILITIES: Mapping[str, AgentCapabilities] = MappingProxyType({
     "chat": AgentCapabilities(
         mode="chat",
-        intents={
-            "availability": True,
-            "reading_history": True,
-            "series_author": True,
-            "student_snapshot": True,
-            "reserve_hold": True,
-            "onboard_from_history": True,
-            "recommendations": True,
-        },
-        signals={
-            "onboard_save_intent": True,
-            "profile_query": True,
-        },
+        intent_mask=Intent.AVAILABILITY
+        | Intent.READING_HISTORY
+        | Intent.SERIES_AUTHOR
+        | Intent.STUDENT_SNAPSHOT
+        | Intent.RESERVE_HOLD
+        | Intent.ONBOARD_FROM_HISTORY
+        | Intent.RECOMMENDATIONS,
+        signal_mask=Signal.ONBOARD_SAVE_INTENT | Signal.PROFILE_QUERY,
         use_filters=False,
         availability_limit=5,
         recommendation_style="chat",
     ),
     "concierge": AgentCapabilities(
         mode="concierge",
-        intents={
-            "availability": True,
-            "reading_history": False,
-            "series_author": True,
-            "student_snapshot": False,
-            "reserve_hold": False,
-            "onboard_from_history": True,
-            "recommendations": True,
-        },
-        signals={
-            "onboard_save_intent": True,
-            "profile_query": False,
-        },
+        intent_mask=Intent.AVAILABILITY
+        | Intent.SERIES_AUTHOR
+        | Intent.ONBOARD_FROM_HISTORY
+        | Intent.RECOMMENDATIONS,
+        signal_mask=Signal.ONBOARD_SAVE_INTENT,
         use_filters=True,
         availability_limit=200,
         recommendation_style="concierge",
     ),
-}
+})
 
 
 def _merge_capability(
     base: AgentCapabilities,
     overrides: Dict[str, Any],
 ) -> AgentCapabilities:
-    intents = dict(base.intents)
+    intents = base.intents
     intents.update(overrides.get("intents", {}) or {})
 
-    signals = dict(base.signals)
+    signals = base.signals
     signals.update(overrides.get("signals", {}) or {})
 
     use_filters = overrides.get("use_filters", base.use_filters)
@@ -91,21 +137,22 @@ def _merge_capability(
 
     return AgentCapabilities(
         mode=base.mode,
-        intents=intents,
-        signals=signals,
+        intent_mask=_intent_mask(intents),
+        signal_mask=_signal_mask(signals),
         use_filters=bool(use_filters),
         availability_limit=int(availability_limit),
         recommendation_style=recommendation_style,
     )
 
 
-def load_capabilities() -> Dict[str, AgentCapabilities]:
+_CAPABILITIES_CACHE: Tuple[int, int, Mapping[str, AgentCapabilities]] | None = None
+
+
+def _read_capabilities() -> Dict[str, AgentCapabilities]:
     capabilities = dict(DEFAULT_CAPABILITIES)
-    if not CAPABILITIES_PATH.exists():
-        return capabilities
     try:
         payload = json.loads(CAPABILITIES_PATH.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
+    except (OSError, json.JSONDecodeError):
         return capabilities
 
     if not isinstance(payload, dict):
@@ -118,6 +165,48 @@ def load_capabilities() -> Dict[str, AgentCapabilities]:
     return capabilities
 
 
+def load_capabilities() -> Mapping[str, AgentCapabilities]:
+    global _CAPABILITIES_CACHE
+    try:
+        stat = CAPABILITIES_PATH.stat()
+    except OSError:
+        return DEFAULT_CAPABILITIES
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _CAPABILITIES_CACHE is not None and _CAPABILITIES_CACHE[:2] == key:
+        return _CAPABILITIES_CACHE[2]
+    capabilities = MappingProxyType(_read_capabilities())
+    _CAPABILITIES_CACHE = (*key, capabilities)
+    return capabilities
+
+
+def _popularity_boosts(catalog: Catalog, recommender: Any) -> Tuple[float, ...]:
+    """Per-row loan-count bonus aligned with catalog.columns."""
+    if recommender.books is catalog.books:
+        # Built once by the recommender, in the same books-dict order.
+        return recommender.popularity_boosts
+    return recommender.popularity_boosts_for(catalog.columns.book_ids)
+
+
+def _allowed_book_ids(
+    catalog: Catalog,
+    filters: Dict[str, Any],
+    available_candidates: set[str] | None,
+) -> set[str] | None:
+    """Book ids passing every active filter, or None when nothing is filtered."""
+    rows = filter_rows(
+        catalog.index,
+        genres=filters.get("genres"),
+        availability=filters.get("availability"),
+        reading_level=filters.get("reading_level"),
+        language=filters.get("language"),
+        book_ids=available_candidates,
+    )
+    if rows is None:
+        return None
+    book_ids = catalog.columns.book_ids
+    return {book_ids[row] for row in rows}
+
+
 @dataclass
 class AgentResult:
     event_id: str
@@ -168,12 +257,15 @@ def run_agent(
     history_texts: Iterable[str] | None = None,
     availability_only: bool = False,
     limit: int = 5,
-    books: Dict[str, Any],
+    catalog: Catalog,
     students: Dict[str, Any],
     loans: List[Any],
     recommender: Any,
 ) -> AgentResult:
+    books = catalog.books
     message = message or ""
+    message_lower = message.lower()
+    now = now_iso()
     capabilities = load_capabilities()
     cap = capabilities.get(mode, DEFAULT_CAPABILITIES[mode])
     history_texts_list = list(history_texts or [])
@@ -183,21 +275,18 @@ def run_agent(
     if not resolved_student_id and history_texts_list:
         resolved_student_id = extract_student_id(history_texts_list)
 
-    existing_profile = (
-        state.get("onboarding_profiles", {}).get(resolved_student_id)
-        if resolved_student_id
-        else None
-    )
-
-    book_genres = sorted({book.genre for book in books.values() if book.genre})
+    profiles = state.setdefault("onboarding_profiles", {})
+    existing_profile = profiles.get(resolved_student_id) if resolved_student_id else None
 
     filters: Dict[str, Any] = {}
     if cap.use_filters:
-        filters = extract_filters(message, existing_profile, book_genres)
+        filters = extract_filters(message, existing_profile, catalog.genre_set)
         if availability_only:
             filters["availability"] = "Available"
 
-    tokens = [token for token in normalize(message).split() if token]
+    # normalize() lowercases itself; keying on the raw message shares the
+    # cache entry with extract_filters and the concierge reply.
+    tokens = normalize(message).split()
 
     tools_called: List[str] = []
 
@@ -205,74 +294,47 @@ def run_agent(
         tools_called.append(name)
         return call_tool(name, **kwargs)
 
-    availability_hint = availability_only if cap.intents.get("availability") else False
-    if cap.intents.get("availability") and action_detect("availability", message):
+    intent_mask = cap.intent_mask
+    signal_mask = cap.signal_mask
+    enabled_actions = [name for name, flag in INTENT_FLAGS.items() if intent_mask & flag]
+    action_hits = detect_actions(message, enabled_actions)
+
+    availability_hint = availability_only if intent_mask & Intent.AVAILABILITY else False
+    if "availability" in action_hits:
         availability_hint = True
 
-    continuation_hint = cap.intents.get("series_author") and action_detect(
-        "series_author", message
-    )
-    history_hint = cap.intents.get("reading_history") and action_detect(
-        "reading_history", message
-    )
-    snapshot_hint = cap.intents.get("student_snapshot") and action_detect(
-        "student_snapshot", message
-    )
-    hold_hint = cap.intents.get("reserve_hold") and action_detect(
-        "reserve_hold", message
-    )
-    onboarding_hint = cap.intents.get("onboard_from_history") and action_detect(
-        "onboard_from_history", message
-    )
-    save_onboarding = cap.signals.get("onboard_save_intent") and signal_detect(
+    continuation_hint = "series_author" in action_hits
+    history_hint = "reading_history" in action_hits
+    snapshot_hint = "student_snapshot" in action_hits
+    hold_hint = "reserve_hold" in action_hits
+    onboarding_hint = "onboard_from_history" in action_hits
+    save_onboarding = signal_mask & Signal.ONBOARD_SAVE_INTENT and signal_detect(
         "onboard_save_intent", message
     )
-    profile_query = cap.signals.get("profile_query") and "profile" in message.lower()
-
-    if (
-        not history_hint
-        and resolved_student_id
-        and cap.intents.get("reading_history")
-        and history_texts_list
-    ):
-        recent = history_texts_list[-6:]
-        for text in reversed(recent[:-1] if len(recent) > 1 else recent):
-            if action_detect("reading_history", text):
-                history_hint = True
-                break
-    if (
-        not snapshot_hint
-        and resolved_student_id
-        and cap.intents.get("student_snapshot")
-        and history_texts_list
-    ):
-        recent = history_texts_list[-6:]
-        for text in reversed(recent[:-1] if len(recent) > 1 else recent):
-            if action_detect("student_snapshot", text):
-                snapshot_hint = True
-                break
-    if (
-        not onboarding_hint
-        and resolved_student_id
-        and cap.intents.get("onboard_from_history")
-        and history_texts_list
-    ):
-        recent = history_texts_list[-6:]
-        for text in reversed(recent[:-1] if len(recent) > 1 else recent):
-            if action_detect("onboard_from_history", text):
-                onboarding_hint = True
-                break
-    if (
-        not hold_hint
-        and resolved_student_id
-        and cap.intents.get("reserve_hold")
-        and history_texts_list
-    ):
+    profile_query = signal_mask & Signal.PROFILE_QUERY and "profile" in message_lower
+
+    pending = [
+        name
+        for name in (
+            "reading_history",
+            "student_snapshot",
+            "onboard_from_history",
+            "reserve_hold",
+        )
+        if name in enabled_actions and name not in action_hits
+    ]
+    if pending and resolved_student_id and history_texts_list:
         recent = history_texts_list[-6:]
         for text in reversed(recent[:-1] if len(recent) > 1 else recent):
-            if action_detect("reserve_hold", text):
-                hold_hint = True
-                break
+            history_hits = detect_actions(text, pending)
+            if history_hits:
+                history_hint = history_hint or "reading_history" in history_hits
+                snapshot_hint = snapshot_hint or "student_snapshot" in history_hits
+                onboarding_hint = onboarding_hint or "onboard_from_history" in history_hits
+                hold_hint = hold_hint or "reserve_hold" in history_hits
+                pending = [name for name in pending if name not in history_hits]
+                if not pending:
+                    break
 
     if save_onboarding and not onboarding_hint:
         onboarding_hint = True
@@ -293,13 +355,14 @@ def run_agent(
     if availability_hint:
         available_books = _call_tool(
             "availability",
-            books=books,
+            catalog=catalog,
             message=message,
-            genres=book_genres,
+            genres=catalog.genres,
             limit=cap.availability_limit,
+            with_candidates=cap.use_filters,
         )
         if cap.use_filters:
-            available_candidates = {book["book_id"] for book in available_books}
+            available_books, available_candidates = available_books
 
     if hold_hint:
         hold_result = _call_tool(
@@ -337,18 +400,13 @@ def run_agent(
             )
             onboarding_profile = onboarding_result.get("profile", {}) or None
             if onboarding_profile:
-                existing_profile = state.get("onboarding_profiles", {}).get(
-                    resolved_student_id
-                )
                 should_save = save_onboarding or not existing_profile
                 if should_save:
                     profile = dict(existing_profile or {})
                     profile.update(onboarding_profile)
-                    profile.setdefault("created_at", now_iso())
-                    profile["updated_at"] = now_iso()
-                    state.setdefault("onboarding_profiles", {})[
-                        resolved_student_id
-                    ] = profile
+                    profile.setdefault("created_at", now)
+                    profile["updated_at"] = now
+                    profiles[resolved_student_id] = profile
                     save_state(state)
                     onboarding_saved = True
                     existing_profile = profile
@@ -370,23 +428,13 @@ def run_agent(
         else:
             needs_student_id = True
 
-    def _book_matches_filters(book: Dict[str, Any]) -> bool:
-        if available_candidates is not None and book.get("book_id") not in available_candidates:
-            return False
-        if filters.get("availability") and book.get("availability") != filters["availability"]:
-            return False
-        if filters.get("genres") and book.get("genre") not in filters["genres"]:
-            return False
-        if filters.get("reading_level") and book.get("reading_level") != filters["reading_level"]:
-            return False
-        if filters.get("language") and book.get("language") != filters["language"]:
-            return False
-        return True
+    # One filter pass per request; every source below checks membership.
+    passes_filters = _allowed_book_ids(catalog, filters, available_candidates)
 
     if continuation_hint:
         continuation_result = _call_tool(
             "series_author",
-            books=books,
+            catalog=catalog,
             message=message,
             limit=limit,
         )
@@ -400,11 +448,11 @@ def run_agent(
                     for rec in continuation_recs
                     if rec["book"].get("availability") == "Available"
                 ]
-            if cap.use_filters:
+            if cap.use_filters and passes_filters is not None:
                 continuation_recs = [
                     rec
                     for rec in continuation_recs
-                    if _book_matches_filters(rec.get("book", {}))
+                    if rec["book"]["book_id"] in passes_filters
                 ]
         if cap.use_filters:
             if continuation_recs:
@@ -412,58 +460,55 @@ def run_agent(
             else:
                 continuation_note = "No series/author continuation matches found in the catalog."
 
-    wants_recs = cap.intents.get("recommendations") and wants_recommendations(message)
+    wants_recs = intent_mask & Intent.RECOMMENDATIONS and wants_recommendations(message_lower)
 
     if cap.recommendation_style == "concierge":
+        book_dicts = catalog.dicts
         if continuation_hint:
             recommendations = continuation_recs
         elif resolved_student_id:
             recs = recommender.recommend(resolved_student_id, k=limit)
             for rec in recs:
-                book = books.get(rec.book_id)
-                if not book:
+                if passes_filters is not None and rec.book_id not in passes_filters:
                     continue
-                book_data = asdict(book)
-                if not _book_matches_filters(book_data):
+                book_data = book_dicts.get(rec.book_id)
+                if book_data is None:
                     continue
-                similar_book = books.get(rec.similar_to) if rec.similar_to else None
+                similar_data = book_dicts.get(rec.similar_to) if rec.similar_to else None
                 recommendations.append(
                     {
                         "book": book_data,
                         "score": round(rec.score, 3),
-                        "similar_to": asdict(similar_book) if similar_book else None,
-                        "reason": default_reason(
-                            book_data, asdict(similar_book) if similar_book else None
-                        ),
+                        "similar_to": similar_data,
+                        "reason": default_reason(book_data, similar_data),
                     }
                 )
 
         if len(recommendations) < limit and not continuation_hint:
             exclude_ids = {rec["book"]["book_id"] for rec in recommendations}
-            scored: List[tuple[float, Dict[str, Any]]] = []
-            for book in books.values():
-                if available_candidates is not None and book.book_id not in available_candidates:
-                    continue
-                if book.book_id in exclude_ids:
-                    continue
-                book_data = asdict(book)
-                score = score_book(
-                    book_data,
-                    tokens,
-                    filters,
-                    weight_reading_level=2.5,
-                    weight_genre=3.0,
-                    weight_availability=0.5,
-                    weight_token=1.0,
-                )
-                if score is None:
-                    continue
-                score += recommender._book_counts.get(book.book_id, 0) * 0.05
-                scored.append((score, book_data))
-
+            rows = filter_rows(
+                catalog.index,
+                genres=filters.get("genres"),
+                availability=filters.get("availability"),
+                language=filters.get("language"),
+                book_ids=available_candidates,
+            )
+            scored = score_catalog(
+                catalog.columns,
+                tokens,
+                filters,
+                exclude=exclude_ids,
+                rows=rows,
+                boosts=_popularity_boosts(catalog, recommender),
+                weight_reading_level=2.5,
+                weight_genre=3.0,
+                weight_availability=0.5,
+                weight_token=1.0,
+            )
             scored_candidates = len(scored)
-            scored.sort(key=lambda item: item[0], reverse=True)
-            for score, book_data in scored[: limit - len(recommendations)]:
+            top = heapq.nlargest(limit - len(recommendations), scored, key=itemgetter(0))
+            for score, book_id in top:
+                book_data = book_dicts[book_id]
                 recommendations.append(
                     {
                         "book": book_data,
@@ -480,7 +525,7 @@ def run_agent(
                 recommendations = build_recommendations(
                     student_id=resolved_student_id,
                     k=5,
-                    books=books,
+                    book_dicts=catalog.dicts,
                     recommender=recommender,
                     reason_fn=default_reason,
                 )
@@ -547,7 +592,7 @@ def run_agent(
     record_observability(
         {
             "event_id": event_id,
-            "created_at": now_iso(),
+            "created_at": now,
             "mode": mode,
             "message": message[:200],
             "student_id": resolved_student_id,
@@ -1,3 +1,7 @@
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, TypedDict
+
 CHAT_SYSTEM_PROMPT = (
     "You are a helpful librarian assistant. Provide concise, friendly "
     "recommendations and talking points for students and librarians. "
@@ -28,137 +32,302 @@ CONCIERGE_USER_TEMPLATE = (
     "Request: {request}"
 )
 
+CHAT_PROMPT_CACHE_KEY = "qvest-chat"
+CONCIERGE_PROMPT_CACHE_KEY = "qvest-concierge"
+
+_HDR_AVAILABLE = "Available titles matching request:"
+_HDR_HISTORY = "Reading history:"
+_HDR_HOLD_AMBIG = "Hold request needs clarification. Matches:"
+_HDR_CONT = "Series/author continuation matches:"
+_HDR_RECS = "Recommended titles for reference (use only these in your reply):"
+_SEP = " · "
+_MINIMAL_NOTE_KNOWN = (
+    "Known student_id: {student_id}.\n"
+    "No saved onboarding profile was found for this student."
+)
+_MINIMAL_NOTE_UNKNOWN = "Known student_id: unknown."
+
+
+class ContextDict(TypedDict, total=False):
+    student_id: str | None
+    needs_student_id: bool
+    filters: Dict[str, Any]
+    available_books: List[Dict[str, Any]]
+    reading_history: List[Dict[str, Any]]
+    hold_result: Dict[str, Any] | None
+    continuation_recs: List[Dict[str, Any]]
+    continuation_note: str | None
+    snapshot: Dict[str, Any] | None
+    onboarding_profile: Dict[str, Any] | None
+    existing_profile: Dict[str, Any] | None
+    onboarding_saved: bool
+    onboarding_pending: bool
+    recommendations: List[Dict[str, Any]]
+
+
+Writer = Callable[[str], Any]
 
-def _format_profile_summary(profile: dict, *, fallback: str) -> str:
+
+@lru_cache(maxsize=8)
+def _system_message(system_prompt: str) -> Dict[str, str]:
+    # Shared across requests; the client only reads it.
+    return {"role": "system", "content": system_prompt}
+
+
+def build_model_input(
+    system_prompt: str,
+    context_note: str,
+    turns: Iterable[dict],
+) -> list[dict]:
+    """Order messages static-first so provider prefix caching can reuse the system prompt."""
+    return [
+        _system_message(system_prompt),
+        {"role": "system", "content": context_note},
+        *turns,
+    ]
+
+
+@lru_cache(maxsize=512)
+def _profile_summary(genres: str, level: str, interests: str, fallback: str) -> str:
     parts = []
-    if profile.get("preferred_genres"):
-        parts.append(f"Genres: {profile['preferred_genres']}")
-    if profile.get("reading_level"):
-        parts.append(f"Level: {profile['reading_level']}")
-    if profile.get("interests"):
-        parts.append(f"Interests: {profile['interests']}")
-    return " · ".join(parts) if parts else fallback
+    if genres:
+        parts.append(f"Genres: {genres}")
+    if level:
+        parts.append(f"Level: {level}")
+    if interests:
+        parts.append(f"Interests: {interests}")
+    return _SEP.join(parts) if parts else fallback
+
+
+def format_profile_summary(profile: Dict[str, Any], *, fallback: str) -> str:
+    return _profile_summary(
+        profile.get("preferred_genres") or "",
+        profile.get("reading_level") or "",
+        profile.get("interests") or "",
+        fallback,
+    )
 
 
-def build_context_note(context: dict) -> str:
-    lines = [f"Known student_id: {context.get('student_id') or 'unknown'}."]
+_get_book = itemgetter("book")
+_get_title_author = itemgetter("title", "author")
+_format_book_row = "\n{title} by {author} ({genre}, level {reading_level})".format_map
 
+# Catalog rows are static per book_id, so each one is formatted once.
+_BOOK_ROWS: Dict[str, str] = {}
+_BOOK_ROWS_MAX = 8192
+
+
+def _fmt_book_row(book: Dict[str, Any]) -> str:
+    book_id = book.get("book_id")
+    row = _BOOK_ROWS.get(book_id)
+    if row is None:
+        row = _format_book_row(book)
+        if book_id is not None and len(_BOOK_ROWS) < _BOOK_ROWS_MAX:
+            _BOOK_ROWS[book_id] = row
+    return row
+
+
+def _fmt_history_row(item: Dict[str, Any]) -> str:
+    title, author = _get_title_author(item["book"])
+    return f"\n{title} by {author} ({item['last_checkout'] or 'date unknown'})"
+
+
+def _fmt_continuation_row(book: Dict[str, Any]) -> str:
+    title, author = _get_title_author(book)
+    return f"\n{title} by {author} ({book.get('genre', 'n/a')})"
+
+
+def _student_section(context: ContextDict, write: Writer) -> None:
+    write(f"Known student_id: {context.get('student_id') or 'unknown'}.")
+
+
+def _needs_student_section(context: ContextDict, write: Writer) -> None:
     if context.get("needs_student_id"):
-        lines.append(
-            "Student_id is missing. Ask for it before recommending or updating records."
-        )
+        write("Student_id is missing. Ask for it before recommending or updating records.")
 
-    filters = context.get("filters") or {}
-    if filters:
-        filter_parts = []
-        for key, value in filters.items():
-            if isinstance(value, list):
-                display = ", ".join(value)
-            else:
-                display = str(value)
-            filter_parts.append(f"{key}={display}")
-        lines.append("Filters applied: " + "; ".join(filter_parts) + ".")
-
-    available_books = context.get("available_books") or []
-    if available_books:
-        available_lines = [
-            f"{book['title']} by {book['author']} ({book['genre']}, level {book['reading_level']})"
-            for book in available_books
-        ]
-        lines.append(
-            "Available titles matching request:\n" + "\n".join(available_lines)
-        )
 
-    reading_history = context.get("reading_history") or []
-    if reading_history:
-        history_lines = [
-            f"{item['book']['title']} by {item['book']['author']} ({item['last_checkout'] or 'date unknown'})"
-            for item in reading_history
-        ]
-        lines.append("Reading history:\n" + "\n".join(history_lines))
+def _filters_section(context: ContextDict, write: Writer) -> None:
+    filters = context.get("filters")
+    if not filters:
+        return
+    write("Filters applied: ")
+    separator = ""
+    for key in sorted(filters):
+        value = filters[key]
+        display = ", ".join(sorted(value)) if isinstance(value, list) else str(value)
+        write(f"{separator}{key}={display}")
+        separator = "; "
+    write(".")
+
 
+def _available_books_section(context: ContextDict, write: Writer) -> None:
+    available_books = context.get("available_books")
+    if not available_books:
+        return
+    write(_HDR_AVAILABLE)
+    for row in map(_fmt_book_row, available_books):
+        write(row)
+
+
+def _reading_history_section(context: ContextDict, write: Writer) -> None:
+    reading_history = context.get("reading_history")
+    if not reading_history:
+        return
+    write(_HDR_HISTORY)
+    for row in map(_fmt_history_row, reading_history):
+        write(row)
+
+
+def _hold_section(context: ContextDict, write: Writer) -> None:
     hold_result = context.get("hold_result")
-    if hold_result:
-        status = hold_result.get("status", "unknown")
-        message = hold_result.get("message", "")
-        if status == "ambiguous":
-            matches = hold_result.get("matches", [])
-            match_lines = [
-                f"{item.get('title')} by {item.get('author')} (ID {item.get('book_id')})"
-                for item in matches
-            ]
-            lines.append(
-                "Hold request needs clarification. Matches:\n" + "\n".join(match_lines)
-            )
-        else:
-            lines.append(f"Hold request status: {status}. {message}")
-
-    continuation_recs = context.get("continuation_recs") or []
-    continuation_note = context.get("continuation_note")
-    if continuation_recs:
-        continuation_lines = [
-            f"{rec['book']['title']} by {rec['book']['author']} ({rec['book'].get('genre', 'n/a')})"
-            for rec in continuation_recs
-        ]
-        lines.append(
-            "Series/author continuation matches:\n" + "\n".join(continuation_lines)
-        )
-    elif continuation_note:
-        lines.append(continuation_note)
+    if not hold_result:
+        return
+    status = hold_result.get("status", "unknown")
+    if status != "ambiguous":
+        write(f"Hold request status: {status}. {hold_result.get('message', '')}")
+        return
+    write(_HDR_HOLD_AMBIG)
+    for item in hold_result.get("matches", []):
+        write(f"\n{item.get('title')} by {item.get('author')} (ID {item.get('book_id')})")
+
+
+def _continuation_section(context: ContextDict, write: Writer) -> None:
+    continuation_recs = context.get("continuation_recs")
+    if not continuation_recs:
+        note = context.get("continuation_note")
+        if note:
+            write(note)
+        return
+    write(_HDR_CONT)
+    for row in map(_fmt_continuation_row, map(_get_book, continuation_recs)):
+        write(row)
 
+
+def _snapshot_section(context: ContextDict, write: Writer) -> None:
     snapshot = context.get("snapshot")
-    if snapshot:
-        stats = snapshot.get("stats", {})
-        top_genres = ", ".join([item["genre"] for item in stats.get("top_genres", [])])
-        top_authors = ", ".join([item["author"] for item in stats.get("top_authors", [])])
-        recent_titles = ", ".join([item["title"] for item in stats.get("recent_books", [])])
-        snapshot_line = (
-            f"Student snapshot: total loans {stats.get('total_loans', 0)}, "
-            f"unique books {stats.get('unique_books', 0)}, "
-            f"last checkout {stats.get('last_checkout') or 'n/a'}."
-        )
-        if top_genres:
-            snapshot_line += f" Top genres: {top_genres}."
-        if top_authors:
-            snapshot_line += f" Top authors: {top_authors}."
-        if recent_titles:
-            snapshot_line += f" Recent reads: {recent_titles}."
-        lines.append(snapshot_line)
+    if not snapshot:
+        return
+    stats = snapshot.get("stats", {})
+    top_genres = ", ".join([item["genre"] for item in stats.get("top_genres", [])])
+    top_authors = ", ".join([item["author"] for item in stats.get("top_authors", [])])
+    recent_titles = ", ".join([item["title"] for item in stats.get("recent_books", [])])
+    write(
+        f"Student snapshot: total loans {stats.get('total_loans', 0)}, "
+        f"unique books {stats.get('unique_books', 0)}, "
+        f"last checkout {stats.get('last_checkout') or 'n/a'}."
+    )
+    if top_genres:
+        write(f" Top genres: {top_genres}.")
+    if top_authors:
+        write(f" Top authors: {top_authors}.")
+    if recent_titles:
+        write(f" Recent reads: {recent_titles}.")
+
 
+def _onboarding_section(context: ContextDict, write: Writer) -> None:
     onboarding_profile = context.get("onboarding_profile")
     existing_profile = context.get("existing_profile")
-    onboarding_saved = context.get("onboarding_saved")
-    onboarding_pending = context.get("onboarding_pending")
     if onboarding_profile:
-        summary = _format_profile_summary(
+        summary = format_profile_summary(
             onboarding_profile,
             fallback="Profile generated from history.",
         )
-        decision_note = ""
-        if onboarding_saved:
-            decision_note = " Saved."
-        elif onboarding_pending:
-            decision_note = " A profile already exists; ask to save changes."
-        line = f"Onboarding profile summary: {summary}"
-        lines.append(line + decision_note)
+        write(f"Onboarding profile summary: {summary}")
+        if context.get("onboarding_saved"):
+            write(" Saved.")
+        elif context.get("onboarding_pending"):
+            write(" A profile already exists; ask to save changes.")
     elif existing_profile:
-        summary = _format_profile_summary(existing_profile, fallback="Profile saved.")
-        lines.append(f"Existing onboarding profile: {summary}")
+        summary = format_profile_summary(existing_profile, fallback="Profile saved.")
+        write(f"Existing onboarding profile: {summary}")
     elif context.get("student_id"):
-        lines.append("No saved onboarding profile was found for this student.")
-
-    recommendations = context.get("recommendations") or []
-    if recommendations:
-        summary_lines = [
-            (
-                f"{rec['book']['title']} by {rec['book']['author']} "
-                f"({rec['book']['genre']}, level {rec['book']['reading_level']})"
-            )
-            for rec in recommendations
-        ]
-        lines.append(
-            "Recommended titles for reference (use only these in your reply):\n"
-            + "\n".join(summary_lines)
+        write("No saved onboarding profile was found for this student.")
+
+
+def _recommendations_section(context: ContextDict, write: Writer) -> None:
+    recommendations = context.get("recommendations")
+    if not recommendations:
+        return
+    write(_HDR_RECS)
+    for row in map(_fmt_book_row, map(_get_book, recommendations)):
+        write(row)
+
+
+# Canonical emission order: stable sections first, per-turn sections last,
+# so consecutive requests share the longest possible byte-identical prefix.
+CONTEXT_MODULES = (
+    ("student_id", _student_section),
+    ("needs_student_id", _needs_student_section),
+    ("snapshot", _snapshot_section),
+    ("onboarding", _onboarding_section),
+    ("filters", _filters_section),
+    ("reading_history", _reading_history_section),
+    ("available_books", _available_books_section),
+    ("continuation", _continuation_section),
+    ("hold_result", _hold_section),
+    ("recommendations", _recommendations_section),
+)
+
+
+# Context keys whose truthiness can make a section emit anything; None means
+# the section always writes (student_id falls back to "unknown").
+_SECTION_TRIGGERS = {
+    "student_id": None,
+    "needs_student_id": frozenset({"needs_student_id"}),
+    "snapshot": frozenset({"snapshot"}),
+    "onboarding": frozenset({"onboarding_profile", "existing_profile", "student_id"}),
+    "filters": frozenset({"filters"}),
+    "reading_history": frozenset({"reading_history"}),
+    "available_books": frozenset({"available_books"}),
+    "continuation": frozenset({"continuation_recs", "continuation_note"}),
+    "hold_result": frozenset({"hold_result"}),
+    "recommendations": frozenset({"recommendations"}),
+}
+
+_SHAPE_RENDERERS: Dict[frozenset, tuple] = {}
+
+
+def _renderers_for(context: ContextDict) -> tuple:
+    """Return the section renderers that can fire for this context's key shape."""
+    shape = frozenset(key for key, value in context.items() if value)
+    renderers = _SHAPE_RENDERERS.get(shape)
+    if renderers is None:
+        renderers = tuple(
+            render
+            for name, render in CONTEXT_MODULES
+            if _SECTION_TRIGGERS[name] is None or _SECTION_TRIGGERS[name] & shape
         )
+        _SHAPE_RENDERERS[shape] = renderers
+    return renderers
+
+
+def _write_note(context: ContextDict, buf: List[str]) -> None:
+    """Append every section to a single chunk list, newline-separated."""
+    write = buf.append
+    for render in _renderers_for(context):
+        mark = len(buf)
+        if mark:
+            write("\n")
+        render(context, write)
+        if len(buf) == mark + 1 and mark:
+            buf.pop()
+
+
+def is_minimal_context(context: ContextDict) -> bool:
+    """True when nothing beyond the student_id is set."""
+    for key, value in context.items():
+        if value and key != "student_id":
+            return False
+    return True
+
+
+def build_context_note(context: ContextDict) -> str:
+    if is_minimal_context(context):
+        student_id = context.get("student_id")
+        if not student_id:
+            return _MINIMAL_NOTE_UNKNOWN
+        return _MINIMAL_NOTE_KNOWN.format(student_id=student_id)
 
-    return "\n".join(lines)
+    buf: list[str] = []
+    _write_note(context, buf)
+    return "".join(buf)
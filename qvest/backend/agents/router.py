@@ -1,42 +1,59 @@
 from __future__ import annotations
 
+import heapq
 import os
 from collections import Counter
 from dataclasses import asdict
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
 from typing import Any, Dict, List
 
 from fastapi import APIRouter, HTTPException, Query
-from openai import OpenAI
 
-from ..agent_state import load_state, save_state, update_observability
+from ..agent_state import (
+    add_feedback,
+    add_hold,
+    feedback_index,
+    hold_index,
+    load_observability,
+    load_state,
+    save_state,
+    update_observability,
+)
 from . import prompts
 from .engine import run_agent
 from .models import ConciergeRequest, FeedbackRequest, HoldRequest, OnboardingRequest
 from .utils import (
     estimate_token_cost,
     format_concierge_reply,
-    next_id,
+    iso_timestamp,
+    next_counter_id,
+    normalize,
     now_iso,
     parse_token_usage,
 )
+from ..llm_client import create_response, get_openai_client
+from ..scoring import Catalog, filter_rows
 from ..tools import tool_metadata
 
 
-def _get_openai_client_optional() -> OpenAI | None:
-    if not os.getenv("OPENAI_API_KEY"):
-        return None
-    return OpenAI()
-
-
 def create_router(
     *,
-    books: Dict[str, Any],
+    catalog: Catalog,
     students: Dict[str, Any],
     loans: List[Any],
     recommender: Any,
 ) -> APIRouter:
     router = APIRouter(prefix="/agents")
+    model = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+    books = catalog.books
+    book_columns = catalog.columns
+    book_index = catalog.index
+    book_dicts = catalog.dicts
+    # Tools register at import time, so the listing is fixed for the process.
+    tools_payload = {"tools": tool_metadata()}
 
     @router.post("/concierge")
     async def concierge(payload: ConciergeRequest) -> Dict[str, Any]:
@@ -49,29 +66,40 @@ def create_router(
             student_id=payload.student_id,
             availability_only=payload.availability_only,
             limit=payload.limit,
-            books=books,
+            catalog=catalog,
             students=students,
             loans=loans,
             recommender=recommender,
         )
 
-        client = _get_openai_client_optional()
+        client = get_openai_client()
+        if client is not None:
+            context = result.context_payload()
+            if not result.recommendations and prompts.is_minimal_context(context):
+                # Nothing for the model to ground a reply on; use the canned one.
+                client = None
+        # Same string run_agent normalized, so this is a cache hit.
+        normalized_message = normalize(payload.message)
         reply = format_concierge_reply(
-            payload.message, result.recommendations, use_llm=bool(client)
+            payload.message,
+            result.recommendations,
+            use_llm=bool(client),
+            normalized_message=normalized_message,
         )
         if client:
-            context_note = prompts.build_context_note(result.context_payload())
+            context_note = prompts.build_context_note(context)
             system_prompt = prompts.CONCIERGE_SYSTEM_PROMPT
             user_prompt = prompts.CONCIERGE_USER_TEMPLATE.format(request=payload.message)
-            model = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
             try:
-                response = client.responses.create(
+                response = await create_response(
+                    client,
                     model=model,
-                    input=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "system", "content": context_note},
-                        {"role": "user", "content": user_prompt},
-                    ],
+                    input=prompts.build_model_input(
+                        system_prompt,
+                        context_note,
+                        [{"role": "user", "content": user_prompt}],
+                    ),
+                    extra_body={"prompt_cache_key": prompts.CONCIERGE_PROMPT_CACHE_KEY},
                 )
                 reply = response.output_text
                 usage = parse_token_usage(getattr(response, "usage", None))
@@ -86,7 +114,10 @@ def create_router(
                     )
             except Exception:
                 reply = format_concierge_reply(
-                    payload.message, result.recommendations, use_llm=False
+                    payload.message,
+                    result.recommendations,
+                    use_llm=False,
+                    normalized_message=normalized_message,
                 )
         return {
             "reply": reply,
@@ -99,7 +130,7 @@ def create_router(
 
     @router.get("/tools")
     async def agent_tools() -> Dict[str, Any]:
-        return {"tools": tool_metadata()}
+        return tools_payload
 
     @router.get("/observability")
     async def agent_observability(
@@ -108,8 +139,7 @@ def create_router(
         student_id: str | None = None,
         mode: str | None = None,
     ) -> Dict[str, Any]:
-        state = load_state()
-        events = list(reversed(state.get("observability", [])))
+        events = list(reversed(load_observability()))
         if student_id:
             events = [event for event in events if event.get("student_id") == student_id]
         if mode:
@@ -178,28 +208,30 @@ def create_router(
         language: str | None = None,
         limit: int = Query(60, ge=1, le=200),
     ) -> Dict[str, Any]:
-        items = [asdict(book) for book in books.values()]
-        if genre:
-            items = [book for book in items if book["genre"] == genre]
-        if availability:
-            items = [book for book in items if book["availability"] == availability]
-        if reading_level:
-            items = [book for book in items if book["reading_level"] == reading_level]
-        if language:
-            items = [book for book in items if book["language"] == language]
-        return {"results": items[:limit], "total": len(items)}
+        rows = filter_rows(
+            book_index,
+            genres=[genre] if genre else None,
+            availability=availability,
+            reading_level=reading_level,
+            language=language,
+        )
+        if rows is None:
+            matched = list(book_dicts.values())
+        else:
+            matched = [book_dicts[book_columns.book_ids[row]] for row in rows]
+        return {"results": matched[:limit], "total": len(matched)}
 
     @router.get("/holds")
     async def agent_holds(student_id: str | None = None) -> Dict[str, Any]:
         state = load_state()
-        holds = state.get("holds", [])
         if student_id:
-            holds = [hold for hold in holds if hold.get("student_id") == student_id]
+            holds = hold_index(state).by_student.get(student_id, [])
+        else:
+            holds = state.get("holds", [])
         response_holds = []
         for hold in holds:
             hold_data = dict(hold)
-            book = books.get(hold.get("book_id", ""))
-            hold_data["book"] = asdict(book) if book else None
+            hold_data["book"] = book_dicts.get(hold.get("book_id", ""))
             response_holds.append(hold_data)
         return {"holds": response_holds, "count": len(response_holds)}
 
@@ -211,18 +243,17 @@ def create_router(
             raise HTTPException(status_code=404, detail="Book not found")
 
         state = load_state()
-        holds = state.get("holds", [])
-        for hold in holds:
+        index = hold_index(state)
+        for hold in index.by_student.get(payload.student_id, []):
             if (
-                hold.get("student_id") == payload.student_id
-                and hold.get("book_id") == payload.book_id
+                hold.get("book_id") == payload.book_id
                 and hold.get("status") in {"Requested", "Ready"}
             ):
                 hold_copy = dict(hold)
-                hold_copy["book"] = asdict(books[payload.book_id])
+                hold_copy["book"] = book_dicts[payload.book_id]
                 return {"hold": hold_copy, "message": "Hold already exists for this student."}
 
-        hold_id = next_id("H", [hold.get("hold_id", "") for hold in holds])
+        hold_id = next_counter_id(state, "H", index.by_id)
         book = books[payload.book_id]
         status = "Ready" if book.availability == "Available" else "Requested"
         now = datetime.now(timezone.utc)
@@ -232,14 +263,13 @@ def create_router(
             "book_id": payload.book_id,
             "status": status,
             "notes": payload.notes or "",
-            "created_at": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "expires_at": (now + timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "created_at": iso_timestamp(now),
+            "expires_at": iso_timestamp(now + timedelta(days=7)),
         }
-        holds.append(hold)
-        state["holds"] = holds
+        add_hold(state, hold)
         save_state(state)
         hold_copy = dict(hold)
-        hold_copy["book"] = asdict(book)
+        hold_copy["book"] = book_dicts[payload.book_id]
         message = (
             "This title is available now. Hold is marked Ready for pickup."
             if status == "Ready"
@@ -250,23 +280,38 @@ def create_router(
     @router.post("/holds/{hold_id}/cancel")
     async def agent_cancel_hold(hold_id: str) -> Dict[str, Any]:
         state = load_state()
-        holds = state.get("holds", [])
-        for hold in holds:
-            if hold.get("hold_id") == hold_id:
-                hold["status"] = "Canceled"
-                hold["canceled_at"] = now_iso()
-                save_state(state)
-                hold_copy = dict(hold)
-                book = books.get(hold.get("book_id", ""))
-                hold_copy["book"] = asdict(book) if book else None
-                return {"hold": hold_copy, "message": "Hold canceled."}
-        raise HTTPException(status_code=404, detail="Hold not found")
+        hold = hold_index(state).by_id.get(hold_id)
+        if hold is None:
+            raise HTTPException(status_code=404, detail="Hold not found")
+        hold["status"] = "Canceled"
+        hold["canceled_at"] = now_iso()
+        save_state(state)
+        hold_copy = dict(hold)
+        hold_copy["book"] = book_dicts.get(hold.get("book_id", ""))
+        return {"hold": hold_copy, "message": "Hold canceled."}
+
+    @lru_cache(maxsize=1)
+    def collection_gap_report() -> Dict[str, Any]:
+        # books, students and loans are loaded once at startup, so the
+        # report is computed on first use and reused.
+        genre_catalog_counts: Counter[str] = Counter()
+        level_catalog_counts: Counter[str] = Counter()
+        unavailable_by_genre: Counter[str] = Counter()
+        for book in books.values():
+            genre_catalog_counts[book.genre] += 1
+            level_catalog_counts[book.reading_level] += 1
+            if book.availability != "Available":
+                unavailable_by_genre[book.genre] += 1
+
+        genre_loan_counts: Counter[str] = Counter()
+        loan_counts: Counter[str] = Counter()
+        for loan in loans:
+            book = books.get(loan.book_id)
+            if book is None:
+                continue
+            loan_counts[loan.book_id] += 1
+            genre_loan_counts[book.genre] += 1
 
-    @router.get("/collection-gaps")
-    async def agent_collection_gaps() -> Dict[str, Any]:
-        loan_books = [books[loan.book_id] for loan in loans if loan.book_id in books]
-        genre_loan_counts = Counter(book.genre for book in loan_books)
-        genre_catalog_counts = Counter(book.genre for book in books.values())
         genre_pressure = []
         for genre, catalog_count in genre_catalog_counts.items():
             loans_count = genre_loan_counts.get(genre, 0)
@@ -279,9 +324,8 @@ def create_router(
                     "demand_ratio": round(ratio, 2),
                 }
             )
-        genre_pressure.sort(key=lambda item: item["demand_ratio"], reverse=True)
+        genre_pressure = heapq.nlargest(6, genre_pressure, key=itemgetter("demand_ratio"))
 
-        level_catalog_counts = Counter(book.reading_level for book in books.values())
         level_student_counts = Counter(student.reading_level for student in students.values())
         level_pressure = []
         for level, student_count in level_student_counts.items():
@@ -295,11 +339,8 @@ def create_router(
                     "student_ratio": round(ratio, 2),
                 }
             )
-        level_pressure.sort(key=lambda item: item["student_ratio"], reverse=True)
+        level_pressure = heapq.nlargest(6, level_pressure, key=itemgetter("student_ratio"))
 
-        unavailable_by_genre = Counter(
-            book.genre for book in books.values() if book.availability != "Available"
-        )
         availability_hotspots = []
         for genre, total in genre_catalog_counts.items():
             unavailable = unavailable_by_genre.get(genre, 0)
@@ -312,9 +353,10 @@ def create_router(
                     "unavailable_rate": round(rate, 2),
                 }
             )
-        availability_hotspots.sort(key=lambda item: item["unavailable_rate"], reverse=True)
+        availability_hotspots = heapq.nlargest(
+            6, availability_hotspots, key=itemgetter("unavailable_rate")
+        )
 
-        loan_counts = Counter(loan.book_id for loan in loans if loan.book_id in books)
         high_demand_unavailable = []
         for book_id, count in loan_counts.most_common(10):
             book = books.get(book_id)
@@ -348,18 +390,21 @@ def create_router(
             )
 
         return {
-            "generated_at": now_iso(),
             "summary": {
                 "total_books": len(books),
                 "total_loans": len(loans),
             },
-            "genre_pressure": genre_pressure[:6],
-            "reading_level_pressure": level_pressure[:6],
-            "availability_hotspots": availability_hotspots[:6],
+            "genre_pressure": genre_pressure,
+            "reading_level_pressure": level_pressure,
+            "availability_hotspots": availability_hotspots,
             "high_demand_unavailable": high_demand_unavailable,
             "recommendations": recommendations,
         }
 
+    @router.get("/collection-gaps")
+    async def agent_collection_gaps() -> Dict[str, Any]:
+        return {"generated_at": now_iso(), **collection_gap_report()}
+
     @router.post("/feedback")
     async def agent_feedback(payload: FeedbackRequest) -> Dict[str, Any]:
         if payload.student_id not in students:
@@ -368,8 +413,10 @@ def create_router(
             raise HTTPException(status_code=404, detail="Book not found")
 
         state = load_state()
-        feedback = state.get("feedback", [])
-        feedback_id = next_id("F", [entry.get("feedback_id", "") for entry in feedback])
+        feedback = feedback_index(state).feedback
+        feedback_id = next_counter_id(
+            state, "F", (entry.get("feedback_id", "") for entry in feedback)
+        )
         entry = {
             "feedback_id": feedback_id,
             "student_id": payload.student_id,
@@ -378,11 +425,10 @@ def create_router(
             "comment": payload.comment or "",
             "created_at": now_iso(),
         }
-        feedback.append(entry)
-        state["feedback"] = feedback
+        add_feedback(state, entry)
         save_state(state)
         entry_copy = dict(entry)
-        entry_copy["book"] = asdict(books[payload.book_id])
+        entry_copy["book"] = book_dicts[payload.book_id]
         return {"feedback": entry_copy}
 
     @router.get("/feedback")
@@ -393,16 +439,23 @@ def create_router(
     ) -> Dict[str, Any]:
         state = load_state()
         feedback = state.get("feedback", [])
-        if student_id:
-            feedback = [entry for entry in feedback if entry.get("student_id") == student_id]
-        if book_id:
-            feedback = [entry for entry in feedback if entry.get("book_id") == book_id]
-        feedback = list(reversed(feedback))[:limit]
+        if student_id or book_id:
+            # Newest first; stop as soon as the page is full.
+            newest = islice(
+                (
+                    entry
+                    for entry in reversed(feedback)
+                    if (not student_id or entry.get("student_id") == student_id)
+                    and (not book_id or entry.get("book_id") == book_id)
+                ),
+                limit,
+            )
+        else:
+            newest = feedback[-limit:][::-1]
         response_feedback = []
-        for entry in feedback:
+        for entry in newest:
             entry_copy = dict(entry)
-            book = books.get(entry.get("book_id", ""))
-            entry_copy["book"] = asdict(book) if book else None
+            entry_copy["book"] = book_dicts.get(entry.get("book_id", ""))
             response_feedback.append(entry_copy)
         return {"feedback": response_feedback, "count": len(response_feedback)}
 
@@ -417,54 +470,48 @@ def create_router(
                 "recent_feedback": [],
             }
 
-        ratings_by_book: Dict[str, List[int]] = {}
-        ratings_by_genre: Dict[str, List[int]] = {}
-        for entry in feedback:
-            book_id = entry.get("book_id")
-            rating = entry.get("rating")
-            if not book_id or rating is None:
-                continue
-            ratings_by_book.setdefault(book_id, []).append(rating)
-            book = books.get(book_id)
-            if book:
-                ratings_by_genre.setdefault(book.genre, []).append(rating)
-
+        # Running [sum, count] per book, kept as feedback is written; genres
+        # roll up from the per-book totals in the same pass.
         top_rated = []
-        for book_id, ratings in ratings_by_book.items():
-            avg = sum(ratings) / len(ratings)
+        stats_by_genre: Dict[str, List[int]] = {}
+        for book_id, (total, count) in feedback_index(state).rating_stats.items():
             book = books.get(book_id)
             top_rated.append(
                 {
                     "book_id": book_id,
                     "title": book.title if book else book_id,
-                    "avg_rating": round(avg, 2),
-                    "count": len(ratings),
+                    "avg_rating": round(total / count, 2),
+                    "count": count,
                 }
             )
-        top_rated.sort(key=lambda item: (item["avg_rating"], item["count"]), reverse=True)
+            if book:
+                genre_stats = stats_by_genre.setdefault(book.genre, [0, 0])
+                genre_stats[0] += total
+                genre_stats[1] += count
+        top_rated = heapq.nlargest(6, top_rated, key=itemgetter("avg_rating", "count"))
 
         genre_sentiment = []
-        for genre, ratings in ratings_by_genre.items():
-            avg = sum(ratings) / len(ratings)
+        for genre, (total, count) in stats_by_genre.items():
             genre_sentiment.append(
                 {
                     "genre": genre,
-                    "avg_rating": round(avg, 2),
-                    "count": len(ratings),
+                    "avg_rating": round(total / count, 2),
+                    "count": count,
                 }
             )
-        genre_sentiment.sort(key=lambda item: (item["avg_rating"], item["count"]), reverse=True)
+        genre_sentiment = heapq.nlargest(
+            6, genre_sentiment, key=itemgetter("avg_rating", "count")
+        )
 
         recent_feedback = []
-        for entry in list(reversed(feedback))[:5]:
+        for entry in feedback[-5:][::-1]:
             entry_copy = dict(entry)
-            book = books.get(entry.get("book_id", ""))
-            entry_copy["book"] = asdict(book) if book else None
+            entry_copy["book"] = book_dicts.get(entry.get("book_id", ""))
             recent_feedback.append(entry_copy)
 
         return {
-            "top_rated": top_rated[:6],
-            "genre_sentiment": genre_sentiment[:6],
+            "top_rated": top_rated,
+            "genre_sentiment": genre_sentiment,
             "recent_feedback": recent_feedback,
         }
 
@@ -476,32 +523,25 @@ def create_router(
         if student_id not in students:
             raise HTTPException(status_code=404, detail="Student not found")
 
-        state = load_state()
-        feedback = state.get("feedback", [])
-        ratings_by_book: Dict[str, List[int]] = {}
-        for entry in feedback:
-            book_id = entry.get("book_id")
-            rating = entry.get("rating")
-            if not book_id or rating is None:
-                continue
-            ratings_by_book.setdefault(book_id, []).append(rating)
-
         recs = recommender.recommend(student_id, k=k)
+
+        rating_stats = feedback_index(load_state()).rating_stats
+
         enriched = []
         for rec in recs:
             book = books.get(rec.book_id)
             if not book:
                 continue
-            ratings = ratings_by_book.get(rec.book_id, [])
-            avg_rating = sum(ratings) / len(ratings) if ratings else None
+            total, count = rating_stats.get(rec.book_id, (0, 0))
+            avg_rating = total / count if count else None
             feedback_bonus = ((avg_rating - 3) / 2) if avg_rating is not None else 0
             enriched.append(
                 {
-                    "book": asdict(book),
+                    "book": book_dicts[rec.book_id],
                     "base_score": round(rec.score, 3),
                     "feedback_bonus": round(feedback_bonus, 2),
                     "avg_rating": round(avg_rating, 2) if avg_rating is not None else None,
-                    "feedback_count": len(ratings),
+                    "feedback_count": count,
                     "score": round(rec.score + feedback_bonus, 3),
                 }
             )
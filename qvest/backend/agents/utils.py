@@ -3,7 +3,8 @@ from __future__ import annotations
 import os
 import re
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Tuple
 
 
 def default_reason(book: Dict[str, Any], similar_book: Dict[str, Any] | None) -> str:
@@ -14,68 +15,169 @@ def default_reason(book: Dict[str, Any], similar_book: Dict[str, Any] | None) ->
     return f"Popular right now among students who enjoy {book['genre']} stories"
 
 
+def iso_timestamp(value: datetime) -> str:
+    # Same output as strftime("%Y-%m-%dT%H:%M:%SZ") without the strftime call.
+    return (
+        f"{value.year:04d}-{value.month:02d}-{value.day:02d}"
+        f"T{value.hour:02d}:{value.minute:02d}:{value.second:02d}Z"
+    )
+
+
 def now_iso() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return iso_timestamp(datetime.now(timezone.utc))
 
 
-def next_id(prefix: str, existing_ids: Iterable[str], width: int = 4) -> str:
+def _max_suffix(prefix: str, existing_ids: Iterable[str]) -> int:
     max_num = 0
     for item in existing_ids:
         if not item.startswith(prefix):
             continue
-        suffix = item[len(prefix) :]
-        if suffix.isdigit():
-            max_num = max(max_num, int(suffix))
-    return f"{prefix}{max_num + 1:0{width}d}"
+        try:
+            number = int(item[len(prefix) :])
+        except ValueError:
+            continue
+        if number > max_num:
+            max_num = number
+    return max_num
+
+
+def next_id(prefix: str, existing_ids: Iterable[str], width: int = 4) -> str:
+    return f"{prefix}{_max_suffix(prefix, existing_ids) + 1:0{width}d}"
+
+
+def next_counter_id(
+    state: Dict[str, Any],
+    prefix: str,
+    existing_ids: Iterable[str],
+    width: int = 4,
+) -> str:
+    """Allocate the next id from the per-prefix counter kept in state.
+
+    existing_ids is only scanned the first time a prefix is seen, to seed the
+    counter from records written before counters existed.
+    """
+    counters = state.setdefault("counters", {})
+    current = counters.get(prefix)
+    if current is None:
+        current = _max_suffix(prefix, existing_ids)
+    current += 1
+    counters[prefix] = current
+    return f"{prefix}{current:0{width}d}"
+
+
+_SEP_TABLE = str.maketrans({";": "|", ",": "|"})
 
 
 def split_list(value: str | None) -> List[str]:
     if not value:
         return []
-    separators = [";", ","]
-    working = value
-    for sep in separators:
-        working = working.replace(sep, "|")
-    return [item.strip() for item in working.split("|") if item.strip()]
+    return [item for item in (part.strip() for part in value.translate(_SEP_TABLE).split("|")) if item]
 
 
+_NON_WORD_RE = re.compile(r"[^a-z0-9\s-]")
+_LEVEL_RE = re.compile(r"(\d)\s*-\s*(\d)")
+
+
+@lru_cache(maxsize=1024)
 def normalize(text: str) -> str:
-    return re.sub(r"[^a-z0-9\s-]", " ", text.lower()).strip()
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+# One scan for every keyword. The lookahead yields overlapping matches, so
+# each keyword still hits anywhere it appears as a substring; when several
+# values for a filter appear, the highest rank wins.
+_KEYWORD_RE = re.compile(r"(?=(available|in stock|on hold|checked out|spanish|english))")
+_KEYWORD_FILTERS: Dict[str, Tuple[str, str, int]] = {
+    "available": ("availability", "Available", 0),
+    "in stock": ("availability", "Available", 0),
+    "on hold": ("availability", "On Hold", 1),
+    "checked out": ("availability", "Checked Out", 2),
+    "spanish": ("language", "Spanish", 0),
+    "english": ("language", "English", 1),
+}
+_MIN_KEYWORD_LEN = min(map(len, _KEYWORD_FILTERS))
+
+
+@lru_cache(maxsize=64)
+def _lowered_genres(book_genres: FrozenSet[str]) -> Dict[str, str]:
+    # Lowercased genre -> catalog genre, in sorted genre order.
+    return {genre.lower(): genre for genre in sorted(book_genres)}
+
+
+@lru_cache(maxsize=64)
+def _genre_matcher(
+    book_genres: FrozenSet[str],
+) -> Tuple[re.Pattern[str] | None, Dict[str, Tuple[str, ...]], int]:
+    """Alternation over the catalog genres, longest first, and the shortest genre length.
+
+    Only one alternative can match at a given position, so each lowered genre
+    also maps to every genre that is a prefix of it.
+    """
+    lowered = _lowered_genres(book_genres)
+    if not lowered:
+        return None, {}, 0
+    alternatives = sorted(lowered, key=len, reverse=True)
+    pattern = re.compile("(?=(" + "|".join(map(re.escape, alternatives)) + "))")
+    implied = {
+        name: tuple(genre for other, genre in lowered.items() if name.startswith(other))
+        for name in lowered
+    }
+    return pattern, implied, len(alternatives[-1])
 
 
-def extract_filters(
-    message: str,
-    onboarding_profile: Dict[str, Any] | None,
-    book_genres: List[str],
-) -> Dict[str, Any]:
+@lru_cache(maxsize=1024)
+def _message_filters(message: str, book_genres: FrozenSet[str]) -> Tuple[Tuple[str, Any], ...]:
     text = normalize(message)
     filters: Dict[str, Any] = {}
 
-    if "available" in text or "available now" in text or "in stock" in text:
-        filters["availability"] = "Available"
-    if "on hold" in text:
-        filters["availability"] = "On Hold"
-    if "checked out" in text:
-        filters["availability"] = "Checked Out"
-
-    if "spanish" in text:
-        filters["language"] = "Spanish"
-    if "english" in text:
-        filters["language"] = "English"
-
-    level_match = re.search(r"(\d)\s*-\s*(\d)", text)
-    if level_match:
-        filters["reading_level"] = f"{level_match.group(1)}-{level_match.group(2)}"
-
-    genres = [genre for genre in book_genres if genre.lower() in text]
+    # Skip scans that cannot match: short greetings hold no keyword, and a
+    # level range needs a hyphen.
+    if len(text) >= _MIN_KEYWORD_LEN:
+        found: Dict[str, Tuple[int, str]] = {}
+        for match in _KEYWORD_RE.finditer(text):
+            key, value, rank = _KEYWORD_FILTERS[match.group(1)]
+            if key not in found or rank > found[key][0]:
+                found[key] = (rank, value)
+        for key in ("availability", "language"):
+            if key in found:
+                filters[key] = found[key][1]
+
+    if "-" in text:
+        level_match = _LEVEL_RE.search(text)
+        if level_match:
+            filters["reading_level"] = f"{level_match.group(1)}-{level_match.group(2)}"
+
+    genres: Tuple[str, ...] = ()
+    pattern, implied, shortest = _genre_matcher(book_genres)
+    if pattern is not None and len(text) >= shortest:
+        matched = {genre for match in pattern.finditer(text) for genre in implied[match.group(1)]}
+        genres = tuple(sorted(matched))
     if genres:
         filters["genres"] = genres
+    return tuple(filters.items())
+
+
+def extract_filters(
+    message: str,
+    onboarding_profile: Dict[str, Any] | None,
+    book_genres: Iterable[str],
+) -> Dict[str, Any]:
+    # The message-derived part is cached; callers get fresh, mutable copies.
+    # Passing a frozenset avoids rebuilding (and rehashing) the cache key.
+    if not isinstance(book_genres, frozenset):
+        book_genres = frozenset(book_genres)
+    filters: Dict[str, Any] = {
+        key: list(value) if isinstance(value, tuple) else value
+        for key, value in _message_filters(message, book_genres)
+    }
 
     if onboarding_profile:
         preferred = split_list(onboarding_profile.get("preferred_genres"))
         if preferred and "genres" not in filters:
-            preferred_lower = {item.lower() for item in preferred}
-            matched = [genre for genre in book_genres if genre.lower() in preferred_lower]
+            lowered = _lowered_genres(book_genres)
+            matched = sorted(
+                {lowered[item] for item in map(str.lower, preferred) if item in lowered}
+            )
             if matched:
                 filters["genres"] = matched
         if onboarding_profile.get("reading_level") and "reading_level" not in filters:
@@ -88,6 +190,8 @@ def format_concierge_reply(
     message: str,
     recommendations: List[Dict[str, Any]],
     use_llm: bool,
+    *,
+    normalized_message: str | None = None,
 ) -> str:
     if not recommendations:
         return "I couldn't find matches for that request yet. Try a genre, interest, or reading level."
@@ -95,7 +199,9 @@ def format_concierge_reply(
         return ""
 
     lead = "Here are a few librarian-ready picks"
-    if "available" in normalize(message):
+    if normalized_message is None:
+        normalized_message = normalize(message)
+    if "available" in normalized_message:
         lead += " that are available now"
     lead += ": "
     titles = ", ".join([rec["book"]["title"] for rec in recommendations[:3]])
@@ -124,17 +230,13 @@ def build_continuation_recommendations(
     else:
         reason = "Related title from the catalog."
 
-    recommendations: List[Dict[str, Any]] = []
-    for book in results[:limit]:
-        recommendations.append(
-            {
-                "book": book,
-                "score": 0.0,
-                "similar_to": target,
-                "reason": reason,
-            }
-        )
-    return recommendations
+    return [
+        {"book": book, "score": 0.0, "similar_to": target, "reason": reason}
+        for book in results[:limit]
+    ]
+
+
+_USAGE_KEYS = ("input_tokens", "output_tokens", "total_tokens")
 
 
 def parse_token_usage(usage: Any | None) -> Dict[str, int]:
@@ -142,6 +244,9 @@ def parse_token_usage(usage: Any | None) -> Dict[str, int]:
         return {}
     if isinstance(usage, dict):
         data = usage
+        # Already canonical (the common SDK shape): copy the three counts as-is.
+        if all(type(data.get(key)) is int for key in _USAGE_KEYS):
+            return {key: data[key] for key in _USAGE_KEYS}
     elif hasattr(usage, "model_dump"):
         data = usage.model_dump()
     else:
@@ -173,18 +278,12 @@ def parse_token_usage(usage: Any | None) -> Dict[str, int]:
     return usage_out
 
 
-def estimate_token_cost(
-    usage: Dict[str, int],
-    *,
-    model: str | None = None,
-) -> Dict[str, float]:
-    if not usage:
-        return {}
-
-    default_input = float(os.getenv("OPENAI_COST_INPUT_PER_1K", "0.0005"))
-    default_output = float(os.getenv("OPENAI_COST_OUTPUT_PER_1K", "0.0015"))
-    input_rate = default_input
-    output_rate = default_output
+@lru_cache(maxsize=32)
+def _rates_for(model: str | None) -> Tuple[float, float]:
+    # Rates come from the environment, read once per model name; call
+    # _rates_for.cache_clear() after changing the OPENAI_COST_* variables.
+    input_rate = float(os.getenv("OPENAI_COST_INPUT_PER_1K", "0.0005"))
+    output_rate = float(os.getenv("OPENAI_COST_OUTPUT_PER_1K", "0.0015"))
 
     if model:
         normalized = model.upper().replace("-", "_").replace(".", "_")
@@ -194,6 +293,18 @@ def estimate_token_cost(
             input_rate = float(model_input)
         if model_output:
             output_rate = float(model_output)
+    return input_rate, output_rate
+
+
+def estimate_token_cost(
+    usage: Dict[str, int],
+    *,
+    model: str | None = None,
+) -> Dict[str, float]:
+    if not usage:
+        return {}
+
+    input_rate, output_rate = _rates_for(model)
 
     input_tokens = usage.get("input_tokens", 0)
     output_tokens = usage.get("output_tokens", 0)
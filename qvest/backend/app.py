@@ -1,27 +1,33 @@
 from __future__ import annotations
 
+import logging
 import os
 from uuid import uuid4
 from pathlib import Path
-from dataclasses import asdict
-from typing import Any, Dict, List
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Tuple
 
+import orjson
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
 from .agents import create_router, prompts
-from .agents.engine import run_agent
+from .agents.engine import AgentResult, run_agent
 from .agent_state import update_observability
 from .agents.utils import default_reason, estimate_token_cost, parse_token_usage
 from .chat_memory import get_history, set_history
+from .chat_utils import recommendation_rows
 from .data_loader import load_catalog, load_loans, load_students
-from .labels import DRIVER_LABELS
+from .llm_client import create_response, get_openai_client, stream_response
 from .recommender import Recommender
+from .scoring import build_catalog
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="QVest Reading Recommender", version="0.1.0")
 app.add_middleware(
@@ -39,11 +45,28 @@ books = load_catalog()
 students = load_students()
 loans = load_loans()
 recommender = Recommender(books=books, students=students, loans=loans)
+catalog = build_catalog(books)
+
+
+
+def _json_bytes(obj: Any) -> bytes:
+    # orjson serializes the loan dataclasses natively.
+    return orjson.dumps(obj)
+
+
+# The catalog, students and loans never change after startup, so their dicts
+# and the list endpoints' JSON bodies are built once and shared.
+book_dicts = catalog.dicts
+student_dicts = {student_id: asdict(student) for student_id, student in students.items()}
+_CATALOG_JSON = _json_bytes(list(book_dicts.values()))
+_STUDENTS_JSON = _json_bytes(list(student_dicts.values()))
+_LOANS_JSON = _json_bytes(loans)
 
 load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 app.include_router(
     create_router(
-        books=books,
+        catalog=catalog,
         students=students,
         loans=loans,
         recommender=recommender,
@@ -51,19 +74,31 @@ app.include_router(
 )
 
 
+@dataclass(slots=True)
+class RecommendationRow:
+    book: Dict[str, Any]
+    score: float
+    similar_to: Dict[str, Any] | None
+    reason: str
+    driver: str
+    driver_label: str
+    signals: Dict[str, float]
+
+
 class ChatRequest(BaseModel):
     message: str
     session_id: str | None = None
     student_id: str | None = None
 
 
-def _get_openai_client() -> OpenAI:
-    if not os.getenv("OPENAI_API_KEY"):
+def _get_openai_client() -> AsyncOpenAI:
+    client = get_openai_client()
+    if client is None:
         raise HTTPException(
             status_code=500,
             detail="OPENAI_API_KEY is not set on the server.",
         )
-    return OpenAI()
+    return client
 
 
 @app.get("/", include_in_schema=False)
@@ -77,66 +112,48 @@ async def health() -> Dict[str, str]:
 
 
 @app.get("/catalog")
-async def catalog() -> List[Dict[str, Any]]:
-    return [asdict(book) for book in books.values()]
+async def catalog_list() -> Response:
+    return Response(content=_CATALOG_JSON, media_type="application/json")
 
 
 @app.get("/students")
-async def student_list() -> List[Dict[str, Any]]:
-    return [asdict(student) for student in students.values()]
+async def student_list() -> Response:
+    return Response(content=_STUDENTS_JSON, media_type="application/json")
 
 
 @app.get("/loans")
-async def loan_list() -> List[Dict[str, Any]]:
-    return [asdict(loan) for loan in loans]
+async def loan_list() -> Response:
+    return Response(content=_LOANS_JSON, media_type="application/json")
 
 
+# Plain def: scoring the catalog is CPU-bound, so FastAPI runs it in the
+# threadpool instead of on the event loop. The recommender is read-only.
 @app.get("/recommendations")
-async def recommendations(
+def recommendations(
     student_id: str = Query(..., description="Student identifier"),
     k: int = Query(5, ge=1, le=20),
-) -> Dict[str, Any]:
+) -> Response:
     if student_id not in students:
         raise HTTPException(status_code=404, detail="Student not found")
 
-    recs = recommender.recommend(student_id, k=k)
-    response: List[Dict[str, Any]] = []
-
-    for rec in recs:
-        book = books.get(rec.book_id)
-        if not book:
-            continue
-        similar_book = books.get(rec.similar_to) if rec.similar_to else None
-        driver_label = DRIVER_LABELS.get(rec.driver, rec.driver)
-        reason = default_reason(
-            asdict(book), asdict(similar_book) if similar_book else None
-        )
-        if driver_label:
-            reason = f"{reason} (Primary signal: {driver_label})"
-        response.append(
-            {
-                "book": asdict(book),
-                "score": round(rec.score, 3),
-                "similar_to": asdict(similar_book) if similar_book else None,
-                "reason": reason,
-                "driver": rec.driver,
-                "driver_label": driver_label,
-                "signals": rec.signals,
-            }
-        )
+    response = recommendation_rows(
+        recommender.recommend(student_id, k=k),
+        book_dicts,
+        default_reason,
+        RecommendationRow,
+    )
 
-    return {"student": asdict(students[student_id]), "recommendations": response}
+    body = {"student": student_dicts[student_id], "recommendations": response}
+    return Response(content=_json_bytes(body), media_type="application/json")
 
 
-@app.post("/chat")
-async def chat(payload: ChatRequest) -> Dict[str, Any]:
-    client = _get_openai_client()
-    system_prompt = prompts.CHAT_SYSTEM_PROMPT
+async def _start_chat(
+    payload: ChatRequest,
+) -> Tuple[str, Deque[Dict[str, str]], AgentResult, List[Dict[str, Any]]]:
     session_id = payload.session_id or f"CHAT-{uuid4().hex[:12]}"
-    history = get_history(session_id)
+    history = await get_history(session_id)
     history.append({"role": "user", "content": payload.message})
-    history = history[-12:]
-    set_history(session_id, history)
+    await set_history(session_id, history)
     history_texts = [item.get("content", "") for item in history]
 
     result = run_agent(
@@ -144,54 +161,35 @@ async def chat(payload: ChatRequest) -> Dict[str, Any]:
         message=payload.message,
         student_id=payload.student_id,
         history_texts=history_texts,
-        books=books,
+        catalog=catalog,
         students=students,
         loans=loans,
         recommender=recommender,
     )
 
     context_note = prompts.build_context_note(result.context_payload())
-    model = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
-    response = client.responses.create(
-        model=model,
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "system", "content": context_note},
-            *history,
-        ],
-    )
-    assistant_reply = response.output_text
-    usage = parse_token_usage(getattr(response, "usage", None))
-    if usage:
-        update_observability(
-            result.event_id,
-            {
-                "model": model,
-                "token_usage": usage,
-                "cost_estimate": estimate_token_cost(usage, model=model),
-            },
-        )
+    model_input = prompts.build_model_input(prompts.CHAT_SYSTEM_PROMPT, context_note, history)
+    return session_id, history, result, model_input
+
 
-    if result.reading_history and "reading history" not in assistant_reply.lower():
-        history_lines = [
+def _decorate_reply(payload: ChatRequest, result: AgentResult, assistant_reply: str) -> str:
+    # Lowercase the reply once, and again only after it has been extended.
+    reply_lower = assistant_reply.lower()
+    if result.reading_history and "reading history" not in reply_lower:
+        # One join over every line instead of concatenating a joined block.
+        lines = [assistant_reply.strip(), "", "Reading history:"]
+        lines.extend(
             f"- {item['book']['title']} by {item['book']['author']} ({item['last_checkout'] or 'date unknown'})"
             for item in result.reading_history
-        ]
-        assistant_reply = (
-            assistant_reply.strip()
-            + "\n\nReading history:\n"
-            + "\n".join(history_lines)
         )
+        assistant_reply = "\n".join(lines)
+        reply_lower = assistant_reply.lower()
 
-    if result.onboarding_profile and "onboarding profile" not in assistant_reply.lower():
-        summary_parts = []
-        if result.onboarding_profile.get("preferred_genres"):
-            summary_parts.append(f"Genres: {result.onboarding_profile['preferred_genres']}")
-        if result.onboarding_profile.get("reading_level"):
-            summary_parts.append(f"Level: {result.onboarding_profile['reading_level']}")
-        if result.onboarding_profile.get("interests"):
-            summary_parts.append(f"Interests: {result.onboarding_profile['interests']}")
-        summary = " · ".join(summary_parts) if summary_parts else "Profile generated from history."
+    if result.onboarding_profile and "onboarding profile" not in reply_lower:
+        summary = prompts.format_profile_summary(
+            result.onboarding_profile,
+            fallback="Profile generated from history.",
+        )
         if result.onboarding_saved:
             decision_line = "\nSaved."
         elif result.onboarding_pending:
@@ -205,23 +203,36 @@ async def chat(payload: ChatRequest) -> Dict[str, Any]:
             + decision_line
         )
     elif (
-        "profile" in payload.message.lower()
-        and result.existing_profile
-        and "profile" not in assistant_reply.lower()
+        result.existing_profile
+        and "profile" not in reply_lower
+        and "profile" in payload.message.lower()
     ):
-        summary_parts = []
-        if result.existing_profile.get("preferred_genres"):
-            summary_parts.append(f"Genres: {result.existing_profile['preferred_genres']}")
-        if result.existing_profile.get("reading_level"):
-            summary_parts.append(f"Level: {result.existing_profile['reading_level']}")
-        if result.existing_profile.get("interests"):
-            summary_parts.append(f"Interests: {result.existing_profile['interests']}")
-        summary = " · ".join(summary_parts) if summary_parts else "Profile saved."
+        summary = prompts.format_profile_summary(result.existing_profile, fallback="Profile saved.")
         assistant_reply = assistant_reply.strip() + "\n\nProfile:\n" + summary
+    return assistant_reply
+
+
+async def _finish_chat(
+    payload: ChatRequest,
+    session_id: str,
+    history: Deque[Dict[str, str]],
+    result: AgentResult,
+    response: Any,
+) -> Dict[str, Any]:
+    usage = parse_token_usage(getattr(response, "usage", None))
+    if usage:
+        update_observability(
+            result.event_id,
+            {
+                "model": _MODEL,
+                "token_usage": usage,
+                "cost_estimate": estimate_token_cost(usage, model=_MODEL),
+            },
+        )
 
+    assistant_reply = _decorate_reply(payload, result, response.output_text)
     history.append({"role": "assistant", "content": assistant_reply})
-    history = history[-12:]
-    set_history(session_id, history)
+    await set_history(session_id, history)
     return {
         "reply": assistant_reply,
         "session_id": session_id,
@@ -236,3 +247,57 @@ async def chat(payload: ChatRequest) -> Dict[str, Any]:
         "hold_result": result.hold_result,
         "student_snapshot": result.snapshot,
     }
+
+
+@app.post("/chat")
+async def chat(payload: ChatRequest) -> Dict[str, Any]:
+    client = _get_openai_client()
+    session_id, history, result, model_input = await _start_chat(payload)
+    response = await create_response(
+        client,
+        model=_MODEL,
+        input=model_input,
+        extra_body={"prompt_cache_key": prompts.CHAT_PROMPT_CACHE_KEY},
+    )
+    return await _finish_chat(payload, session_id, history, result, response)
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + _json_bytes(data) + b"\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(payload: ChatRequest) -> StreamingResponse:
+    """Same turn as /chat, streamed as server-sent events.
+
+    "delta" events carry reply text as the model produces it; a final "done"
+    event carries the full /chat body, whose reply may append reading history
+    or profile details to the streamed text. If the turn fails after the
+    stream has started, an "error" event carries the detail instead of "done".
+    """
+    client = _get_openai_client()
+    session_id, history, result, model_input = await _start_chat(payload)
+
+    async def events() -> AsyncIterator[bytes]:
+        response = None
+        try:
+            async for kind, value in stream_response(
+                client,
+                model=_MODEL,
+                input=model_input,
+                extra_body={"prompt_cache_key": prompts.CHAT_PROMPT_CACHE_KEY},
+            ):
+                if kind == "delta":
+                    yield _sse("delta", {"text": value})
+                else:
+                    response = value
+            body = await _finish_chat(payload, session_id, history, result, response)
+        except Exception:
+            # The exception text can carry SDK error bodies or connection
+            # details, so it stays in the server log.
+            logger.exception("Chat stream failed")
+            yield _sse("error", {"detail": "Chat stream failed."})
+            return
+        yield _sse("done", body)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
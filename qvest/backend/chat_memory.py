@@ -1,13 +1,66 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import json
+import os
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Deque, Dict
 
-CHAT_SESSIONS: Dict[str, List[Dict[str, str]]] = {}
+try:
+    from redis import asyncio as redis_asyncio  # type: ignore
+except ImportError:  # pragma: no cover - in-process fallback
+    redis_asyncio = None
 
+SESSION_TTL_SECONDS = 3600
+MAX_LOCAL_SESSIONS = 1024
+MAX_HISTORY_TURNS = 12
 
-def get_history(session_id: str) -> List[Dict[str, str]]:
-    return CHAT_SESSIONS.setdefault(session_id, [])
+# Used when REDIS_URL is unset; least recently used sessions are dropped first.
+# Each history is a bounded deque, so appending a turn drops the oldest one.
+CHAT_SESSIONS: "OrderedDict[str, Deque[Dict[str, str]]]" = OrderedDict()
 
 
-def set_history(session_id: str, history: List[Dict[str, str]]) -> None:
+@lru_cache(maxsize=1)
+def redis_client() -> Any | None:
+    # Resolved on first use so REDIS_URL can come from .env.
+    url = os.getenv("REDIS_URL")
+    if not url or redis_asyncio is None:
+        return None
+    return redis_asyncio.Redis.from_url(url, decode_responses=True)
+
+
+def _session_key(session_id: str) -> str:
+    return f"qvest:chat:{session_id}"
+
+
+def _remember(session_id: str, history: Deque[Dict[str, str]]) -> None:
     CHAT_SESSIONS[session_id] = history
+    CHAT_SESSIONS.move_to_end(session_id)
+    while len(CHAT_SESSIONS) > MAX_LOCAL_SESSIONS:
+        CHAT_SESSIONS.popitem(last=False)
+
+
+async def get_history(session_id: str) -> Deque[Dict[str, str]]:
+    client = redis_client()
+    if client is None:
+        history = CHAT_SESSIONS.get(session_id)
+        if history is None:
+            history = deque(maxlen=MAX_HISTORY_TURNS)
+        _remember(session_id, history)
+        return history
+    items = await client.lrange(_session_key(session_id), -MAX_HISTORY_TURNS, -1)
+    return deque((json.loads(item) for item in items), maxlen=MAX_HISTORY_TURNS)
+
+
+async def set_history(session_id: str, history: Deque[Dict[str, str]]) -> None:
+    client = redis_client()
+    if client is None:
+        _remember(session_id, history)
+        return
+    key = _session_key(session_id)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        if history:
+            pipe.rpush(key, *(json.dumps(turn) for turn in history))
+            pipe.expire(key, SESSION_TTL_SECONDS)
+        await pipe.execute()
@@ -1,8 +1,7 @@
 from __future__ import annotations
 
 import re
-from dataclasses import asdict
-from typing import Any, Dict, Iterable, List
+from typing import Any, Callable, Dict, Iterable, List, Sequence
 
 from .labels import DRIVER_LABELS
 
@@ -10,65 +9,85 @@ from .labels import DRIVER_LABELS
 STUDENT_ID_RE = re.compile(r"\bS\d{4}\b", re.IGNORECASE)
 
 
-def extract_student_id(texts: Iterable[str]) -> str | None:
-    for text in reversed(list(texts)):
+def extract_student_id(texts: Sequence[str]) -> str | None:
+    # Newest first; reversed() walks the sequence in place without copying it.
+    search = STUDENT_ID_RE.search
+    for text in reversed(texts):
         if not text:
             continue
-        match = STUDENT_ID_RE.search(text)
+        match = search(text)
         if match:
             return match.group(0).upper()
     return None
 
 
+RECOMMEND_TRIGGERS = (
+    "recommend",
+    "suggest",
+    "read alike",
+    "read-alike",
+    "readalike",
+    "what should i read",
+    "book suggestions",
+    "book recommendation",
+    "good books",
+    "titles for",
+)
+# Plain substring alternation (no word boundaries), so one scan matches
+# exactly what checking each trigger with `in` did.
+_RECOMMEND_RE = re.compile("|".join(map(re.escape, RECOMMEND_TRIGGERS)))
+
+
 def wants_recommendations(message: str) -> bool:
-    text = (message or "").lower()
-    triggers = [
-        "recommend",
-        "suggest",
-        "read alike",
-        "read-alike",
-        "readalike",
-        "what should i read",
-        "book suggestions",
-        "book recommendation",
-        "good books",
-        "titles for",
-    ]
-    return any(trigger in text for trigger in triggers)
+    return _RECOMMEND_RE.search((message or "").lower()) is not None
+
+
+# Reason suffixes for the known drivers; any other driver is labelled by name.
+_DRIVER_SUFFIX = {
+    driver: f" (Primary signal: {label})" for driver, label in DRIVER_LABELS.items()
+}
+
+
+def recommendation_rows(
+    recs: Iterable[Any],
+    book_dicts: Dict[str, Dict[str, Any]],
+    reason_fn: Callable[..., str],
+    row_factory: Callable[..., Any] = dict,
+) -> List[Any]:
+    """Turn recommender results into response rows built by row_factory(**fields)."""
+    rows: List[Any] = []
+    for rec in recs:
+        book_data = book_dicts.get(rec.book_id)
+        if not book_data:
+            continue
+        similar_data = book_dicts.get(rec.similar_to) if rec.similar_to else None
+        driver_label = DRIVER_LABELS.get(rec.driver, rec.driver)
+        suffix = _DRIVER_SUFFIX.get(rec.driver)
+        if suffix is None:
+            suffix = f" (Primary signal: {driver_label})" if driver_label else ""
+        reason = reason_fn(book_data, similar_data) + suffix
+        rows.append(
+            row_factory(
+                book=book_data,
+                score=round(rec.score, 3),
+                similar_to=similar_data,
+                reason=reason,
+                driver=rec.driver,
+                driver_label=driver_label,
+                signals=rec.signals,
+            )
+        )
+    return rows
 
 
 def build_recommendations(
     *,
     student_id: str,
     k: int,
-    books: Dict[str, Any],
+    book_dicts: Dict[str, Dict[str, Any]],
     recommender: Any,
     reason_fn: Any,
 ) -> List[Dict[str, Any]]:
-    recs = recommender.recommend(student_id, k=k)
-    response: List[Dict[str, Any]] = []
-
-    for rec in recs:
-        book = books.get(rec.book_id)
-        if not book:
-            continue
-        similar_book = books.get(rec.similar_to) if rec.similar_to else None
-        driver_label = DRIVER_LABELS.get(rec.driver, rec.driver)
-        reason = reason_fn(
-            asdict(book), asdict(similar_book) if similar_book else None
-        )
-        if driver_label:
-            reason = f"{reason} (Primary signal: {driver_label})"
-        response.append(
-            {
-                "book": asdict(book),
-                "score": round(rec.score, 3),
-                "similar_to": asdict(similar_book) if similar_book else None,
-                "reason": reason,
-                "driver": rec.driver,
-                "driver_label": driver_label,
-                "signals": rec.signals,
-            }
-        )
-
-    return response
+    return recommendation_rows(
+        recommender.recommend(student_id, k=k), book_dicts, reason_fn
+    )
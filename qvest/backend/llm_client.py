@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from functools import lru_cache
+from hashlib import blake2b
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from openai import AsyncOpenAI
+
+from .chat_memory import redis_client
+
+REPLY_CACHE_TTL_SECONDS = 3600
+
+
+@lru_cache(maxsize=1)
+def _shared_client() -> AsyncOpenAI:
+    # One client per process so its HTTP connection pool stays warm. The SDK's
+    # default pool (1000 connections, 100 keep-alive) is already ample.
+    return AsyncOpenAI()
+
+
+def get_openai_client() -> AsyncOpenAI | None:
+    """Return the process-wide async OpenAI client, or None when no API key is set.
+
+    Requests are awaited, so an in-flight completion doesn't block the event loop.
+    """
+    if not os.getenv("OPENAI_API_KEY"):
+        return None
+    return _shared_client()
+
+
+@lru_cache(maxsize=1)
+def _llm_semaphore() -> asyncio.Semaphore:
+    # Built on first use so OPENAI_MAX_CONCURRENCY can come from .env.
+    return asyncio.Semaphore(max(1, int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))))
+
+
+def _reply_cache() -> Any | None:
+    # Opt-in: identical model input only means an identical answer is
+    # acceptable when the deployment says so.
+    if os.getenv("LLM_REPLY_CACHE", "").lower() not in {"1", "true", "yes"}:
+        return None
+    return redis_client()
+
+
+def _reply_cache_key(kwargs: Dict[str, Any]) -> str | None:
+    try:
+        payload = json.dumps(
+            {"model": kwargs.get("model"), "input": kwargs.get("input")},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+    except TypeError:
+        return None
+    return "qvest:llm:" + blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+async def create_response(client: AsyncOpenAI, **kwargs: Any) -> Any:
+    """Call responses.create with at most OPENAI_MAX_CONCURRENCY requests in flight.
+
+    With LLM_REPLY_CACHE enabled and Redis configured, the reply text is cached
+    for an hour keyed on the model and the exact input; cache hits carry no
+    token usage. Rate-limit (429) retries with exponential backoff are left to
+    the SDK's own max_retries handling.
+    """
+    cache = _reply_cache()
+    key = _reply_cache_key(kwargs) if cache is not None else None
+    if key is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            return SimpleNamespace(output_text=cached, usage=None)
+    async with _llm_semaphore():
+        response = await client.responses.create(**kwargs)
+    if key is not None and response.output_text:
+        await cache.set(key, response.output_text, ex=REPLY_CACHE_TTL_SECONDS)
+    return response
+
+
+async def stream_response(client: AsyncOpenAI, **kwargs: Any) -> AsyncIterator[Tuple[str, Any]]:
+    """Stream a response as ("delta", text) pairs, then ("done", final_response).
+
+    Shares create_response's concurrency limit and reply cache; a cached reply
+    arrives as a single delta.
+    """
+    cache = _reply_cache()
+    key = _reply_cache_key(kwargs) if cache is not None else None
+    if key is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            yield "delta", cached
+            yield "done", SimpleNamespace(output_text=cached, usage=None)
+            return
+    async with _llm_semaphore():
+        async with client.responses.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield "delta", event.delta
+            response = await stream.get_final_response()
+    if key is not None and response.output_text:
+        await cache.set(key, response.output_text, ex=REPLY_CACHE_TTL_SECONDS)
+    yield "done", response
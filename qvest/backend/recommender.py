@@ -36,6 +36,8 @@ class Recommender:
         self._book_levels = self._build_book_levels()
         self._max_checkout_date = self._build_max_checkout_date()
         self._loan_weights = self._build_loan_weights()
+        # Catalog-order boosts for rankings over the whole catalog.
+        self.popularity_boosts = self.popularity_boosts_for(self.books)
 
     def _build_student_books(self) -> Dict[str, List[str]]:
         student_books: Dict[str, List[str]] = defaultdict(list)
@@ -128,6 +130,11 @@ class Recommender:
             weights[key] = max(0.2, weight)
         return weights
 
+    def popularity_boosts_for(self, book_ids: Iterable[str]) -> Tuple[float, ...]:
+        """Loan-count bonus per book, in the order of book_ids."""
+        book_count = self._book_counts.get
+        return tuple(book_count(book_id, 0) * 0.05 for book_id in book_ids)
+
     @staticmethod
     def _tokenize(text: str) -> set[str]:
         normalized = (
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import re
-from typing import Any, Dict, Iterable, List
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Sequence, Tuple
 
 DEFAULT_SEARCH_FIELDS = (
     "title",
@@ -14,11 +15,13 @@ DEFAULT_SEARCH_FIELDS = (
     "genre",
 )
 
+_NON_WORD_RE = re.compile(r"[^a-z0-9\s-]")
+
 
 def normalize_text(text: str | None) -> str:
     if not text:
         return ""
-    return re.sub(r"[^a-z0-9\s-]", " ", text.lower()).strip()
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
 
 
 def score_book(
@@ -63,3 +66,262 @@ def score_book(
         if token and token in haystack:
             score += weight_token
     return score
+
+
+@dataclass(frozen=True)
+class CatalogColumns:
+    book_ids: Tuple[str, ...]
+    genres: Tuple[str, ...]
+    reading_levels: Tuple[str, ...]
+    languages: Tuple[str, ...]
+    availability: Tuple[str, ...]
+    haystacks: Tuple[str, ...]
+
+
+def catalog_columns(books: Dict[str, Any]) -> CatalogColumns:
+    values = list(books.values())
+    return CatalogColumns(
+        book_ids=tuple(book.book_id for book in values),
+        genres=tuple(book.genre for book in values),
+        reading_levels=tuple(book.reading_level for book in values),
+        languages=tuple(book.language for book in values),
+        availability=tuple(book.availability for book in values),
+        haystacks=tuple(
+            normalize_text(
+                " ".join(getattr(book, field, "") for field in DEFAULT_SEARCH_FIELDS)
+            )
+            for book in values
+        ),
+    )
+
+
+def catalog_dicts(books: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return asdict() of every book.
+
+    build_catalog() keeps one copy that is shared across responses; copy a
+    dict before changing it.
+    """
+    return {book_id: asdict(book) for book_id, book in books.items()}
+
+
+@dataclass(frozen=True)
+class CatalogIndex:
+    """Inverted indices from filterable attributes to catalog row positions."""
+
+    by_genre: Dict[str, FrozenSet[int]]
+    by_availability: Dict[str, FrozenSet[int]]
+    by_reading_level: Dict[str, FrozenSet[int]]
+    by_language: Dict[str, FrozenSet[int]]
+    positions: Dict[str, int]
+
+
+def _invert(values: Tuple[str, ...]) -> Dict[str, FrozenSet[int]]:
+    rows: Dict[str, List[int]] = {}
+    for position, value in enumerate(values):
+        rows.setdefault(value, []).append(position)
+    return {value: frozenset(positions) for value, positions in rows.items()}
+
+
+def catalog_index(columns: CatalogColumns) -> CatalogIndex:
+    return CatalogIndex(
+        by_genre=_invert(columns.genres),
+        by_availability=_invert(columns.availability),
+        by_reading_level=_invert(columns.reading_levels),
+        by_language=_invert(columns.languages),
+        positions={book_id: position for position, book_id in enumerate(columns.book_ids)},
+    )
+
+
+def _book_year(book: Any) -> int:
+    value = getattr(book, "publication_year", None)
+    if value is None and isinstance(book, dict):
+        value = book.get("publication_year")
+    if not value:
+        return 0
+    try:
+        return int(str(value))
+    except ValueError:
+        return 0
+
+
+@dataclass(frozen=True)
+class SeriesAuthorIndex:
+    """Normalized titles, series and authors, longest first, plus books grouped by them."""
+
+    titles: Tuple[Tuple[str, Any], ...]
+    series_names: Tuple[Tuple[str, str], ...]
+    author_names: Tuple[Tuple[str, str], ...]
+    by_series: Dict[str, Tuple[Any, ...]]
+    by_author: Dict[str, Tuple[Any, ...]]
+
+
+def _longest_first(pairs: Iterable[Tuple[str, Any]]) -> Tuple[Tuple[str, Any], ...]:
+    # Stable sort: among equal lengths the earlier entry still wins, as it did
+    # when every candidate was scanned and only a strictly longer one replaced it.
+    return tuple(sorted((pair for pair in pairs if pair[0]), key=lambda pair: -len(pair[0])))
+
+
+def series_author_index(books: Dict[str, Any]) -> SeriesAuthorIndex:
+    by_series: Dict[str, List[Any]] = {}
+    by_author: Dict[str, List[Any]] = {}
+    for book in books.values():
+        by_series.setdefault(normalize_text(getattr(book, "series", "")), []).append(book)
+        by_author.setdefault(normalize_text(getattr(book, "author", "")), []).append(book)
+    series_names = {getattr(book, "series", "") for book in books.values()} - {""}
+    author_names = {getattr(book, "author", "") for book in books.values()} - {""}
+    return SeriesAuthorIndex(
+        titles=_longest_first(
+            (normalize_text(getattr(book, "title", "")), book) for book in books.values()
+        ),
+        series_names=_longest_first((normalize_text(name), name) for name in series_names),
+        author_names=_longest_first((normalize_text(name), name) for name in author_names),
+        by_series={
+            name: tuple(sorted(group, key=lambda book: (_book_year(book), getattr(book, "title", ""))))
+            for name, group in by_series.items()
+        },
+        by_author={
+            name: tuple(sorted(group, key=lambda book: (-_book_year(book), getattr(book, "title", ""))))
+            for name, group in by_author.items()
+        },
+    )
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """The loaded books plus the lookup structures derived from them.
+
+    Built once at startup by build_catalog() and passed to the engine and tools.
+    """
+
+    books: Dict[str, Any]
+    columns: CatalogColumns
+    index: CatalogIndex
+    dicts: Dict[str, Dict[str, Any]]
+    genres: Tuple[str, ...]
+    genre_set: FrozenSet[str]
+    series_author: SeriesAuthorIndex
+
+
+def build_catalog(books: Dict[str, Any]) -> Catalog:
+    columns = catalog_columns(books)
+    genres = tuple(sorted({genre for genre in columns.genres if genre}))
+    return Catalog(
+        books=books,
+        columns=columns,
+        index=catalog_index(columns),
+        dicts=catalog_dicts(books),
+        genres=genres,
+        genre_set=frozenset(genres),
+        series_author=series_author_index(books),
+    )
+
+
+def filter_rows(
+    index: CatalogIndex,
+    *,
+    genres: Iterable[str] | None = None,
+    availability: str | None = None,
+    reading_level: str | None = None,
+    language: str | None = None,
+    book_ids: Iterable[str] | None = None,
+) -> List[int] | None:
+    """Return catalog rows matching every given filter, in catalog order.
+
+    Returns None when no filter is set, meaning every row matches.
+    """
+    sets: List[FrozenSet[int] | set[int]] = []
+    if genres:
+        matched: set[int] = set()
+        for genre in genres:
+            matched.update(index.by_genre.get(genre, ()))
+        sets.append(matched)
+    if availability:
+        sets.append(index.by_availability.get(availability, frozenset()))
+    if reading_level:
+        sets.append(index.by_reading_level.get(reading_level, frozenset()))
+    if language:
+        sets.append(index.by_language.get(language, frozenset()))
+    if book_ids is not None:
+        positions = index.positions
+        sets.append({positions[book_id] for book_id in book_ids if book_id in positions})
+    if not sets:
+        return None
+    sets.sort(key=len)
+    rows = set(sets[0])
+    for other in sets[1:]:
+        if not rows:
+            break
+        rows.intersection_update(other)
+    return sorted(rows)
+
+
+def score_catalog(
+    columns: CatalogColumns,
+    tokens: Iterable[str],
+    filters: Dict[str, Any],
+    *,
+    candidates: set[str] | None = None,
+    exclude: set[str] | None = None,
+    rows: Iterable[int] | None = None,
+    boosts: Sequence[float] | None = None,
+    weight_reading_level: float = 0.0,
+    weight_language: float = 0.0,
+    weight_genre: float = 0.0,
+    weight_availability: float = 0.0,
+    weight_token: float = 1.0,
+    availability_value: str = "Available",
+) -> List[Tuple[float, str]]:
+    """Score every catalog row with score_book semantics (filters required).
+
+    ``boosts`` is an optional per-row bonus aligned with ``columns`` and added
+    after the filter and token terms.
+    """
+    required_availability = filters.get("availability")
+    required_language = filters.get("language")
+    required_genres = filters.get("genres")
+    required_level = filters.get("reading_level")
+    tokens = [token for token in tokens if token]
+
+    book_ids = columns.book_ids
+    genres = columns.genres
+    levels = columns.reading_levels
+    languages = columns.languages
+    availabilities = columns.availability
+    haystacks = columns.haystacks
+    if rows is None:
+        rows = range(len(book_ids))
+
+    scored: List[Tuple[float, str]] = []
+    for row in rows:
+        book_id = book_ids[row]
+        if candidates is not None and book_id not in candidates:
+            continue
+        if exclude and book_id in exclude:
+            continue
+        availability = availabilities[row]
+        if required_availability and availability != required_availability:
+            continue
+        language = languages[row]
+        if required_language and language != required_language:
+            continue
+        genre = genres[row]
+        if required_genres and genre not in required_genres:
+            continue
+
+        score = 0.0
+        if weight_reading_level and required_level and levels[row] == required_level:
+            score += weight_reading_level
+        if weight_language and required_language and language == required_language:
+            score += weight_language
+        if weight_genre and required_genres and genre in required_genres:
+            score += weight_genre
+        if weight_availability and availability == availability_value:
+            score += weight_availability
+        haystack = haystacks[row]
+        for token in tokens:
+            if token in haystack:
+                score += weight_token
+        if boosts is not None:
+            score += boosts[row]
+        scored.append((score, book_id))
+    return scored
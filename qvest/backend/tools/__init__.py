@@ -1,6 +1,7 @@
 from .router import (
     action_detect,
     call_tool,
+    detect_actions,
     signal_detect,
     tool_detect,
     tool_metadata,
@@ -10,6 +11,7 @@ from .router import (
 __all__ = [
     "action_detect",
     "call_tool",
+    "detect_actions",
     "signal_detect",
     "tool_detect",
     "tool_metadata",
@@ -1,12 +1,20 @@
 from __future__ import annotations
 
+import heapq
 import re
-from dataclasses import asdict
-from typing import Any, Dict, Iterable, List
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Set, Tuple
 
-from ..scoring import score_book
+from ..scoring import (
+    Catalog,
+    filter_rows,
+    normalize_text as _normalize,
+    score_catalog,
+)
 
 AVAILABILITY_RE = re.compile(r"\b(available|in stock|on shelf|available now)\b", re.IGNORECASE)
+_LEVEL_RE = re.compile(r"(\d)\s*-\s*(\d)")
 
 
 def availability_requested(message: str) -> bool:
@@ -15,8 +23,9 @@ def availability_requested(message: str) -> bool:
     return bool(AVAILABILITY_RE.search(message))
 
 
-def _normalize(text: str) -> str:
-    return re.sub(r"[^a-z0-9\s-]", " ", text.lower()).strip()
+@lru_cache(maxsize=4)
+def _lowered(genres: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+    return tuple((genre, genre.lower()) for genre in genres)
 
 
 def _extract_filters(message: str | None, genres: Iterable[str]) -> Dict[str, Any]:
@@ -25,7 +34,7 @@ def _extract_filters(message: str | None, genres: Iterable[str]) -> Dict[str, An
     text = _normalize(message)
     filters: Dict[str, Any] = {}
 
-    level_match = re.search(r"(\d)\s*-\s*(\d)", text)
+    level_match = _LEVEL_RE.search(text)
     if level_match:
         filters["reading_level"] = f"{level_match.group(1)}-{level_match.group(2)}"
 
@@ -34,7 +43,7 @@ def _extract_filters(message: str | None, genres: Iterable[str]) -> Dict[str, An
     if "english" in text:
         filters["language"] = "English"
 
-    genre_matches = [genre for genre in genres if genre.lower() in text]
+    genre_matches = [genre for genre, lowered in _lowered(tuple(genres)) if lowered in text]
     if genre_matches:
         filters["genres"] = genre_matches
 
@@ -42,33 +51,44 @@ def _extract_filters(message: str | None, genres: Iterable[str]) -> Dict[str, An
 
 
 def list_available_books(
-    books: Dict[str, Any],
+    catalog: Catalog,
     *,
     message: str | None = None,
     genres: Iterable[str] | None = None,
-    limit: int = 8,
-) -> List[Dict[str, Any]]:
-    available = []
-    genre_list = list(genres or {book.genre for book in books.values() if book.genre})
-    filters = _extract_filters(message, genre_list)
-    tokens = [token for token in _normalize(message or "").split() if token]
+    limit: int | None = 8,
+    with_candidates: bool = False,
+) -> List[Dict[str, Any]] | Tuple[List[Dict[str, Any]], Set[str]]:
+    """Rank available books for a request.
+
+    With with_candidates, also return the ids of every available book that
+    passes the request's filters, not just the ranked page.
+    """
+    filters = _extract_filters(message, genres or catalog.genres)
+    rows = filter_rows(
+        catalog.index,
+        genres=filters.get("genres"),
+        availability="Available",
+        language=filters.get("language"),
+    )
+    columns = catalog.columns
 
-    for book in books.values():
-        book_data = asdict(book)
-        if book_data.get("availability") != "Available":
-            continue
-        score = score_book(
-            book_data,
-            tokens,
-            filters,
-            weight_reading_level=2.0,
-            weight_language=1.5,
-            weight_genre=2.5,
-            weight_token=1.0,
-        )
-        if score is None:
-            continue
-        available.append((score, book_data))
-
-    available.sort(key=lambda item: item[0], reverse=True)
-    return [item[1] for item in available[:limit]]
+    tokens = [token for token in _normalize(message or "").split() if token]
+    scored = score_catalog(
+        columns,
+        tokens,
+        filters,
+        rows=rows,
+        weight_reading_level=2.0,
+        weight_language=1.5,
+        weight_genre=2.5,
+        weight_token=1.0,
+    )
+    if limit is not None:
+        scored = heapq.nlargest(limit, scored, key=itemgetter(0))
+    else:
+        scored.sort(key=itemgetter(0), reverse=True)
+    book_dicts = catalog.dicts
+    page = [book_dicts[book_id] for _, book_id in scored]
+    if with_candidates:
+        return page, {columns.book_ids[row] for row in rows}
+    return page
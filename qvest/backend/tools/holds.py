@@ -5,8 +5,9 @@ from dataclasses import asdict
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Iterable, List, Tuple
 
-from ..agent_state import load_state, save_state
-from ..agents.utils import next_id
+from ..agent_state import add_hold, hold_index, load_state, save_state
+from ..agents.utils import iso_timestamp, next_counter_id
+from ..scoring import normalize_text as _normalize
 
 
 HOLD_RE = re.compile(
@@ -26,12 +27,6 @@ def hold_requested(message: str) -> bool:
     return bool(HOLD_RE.search(message))
 
 
-def _normalize(text: str) -> str:
-    if not text:
-        return ""
-    return re.sub(r"[^a-z0-9\s-]", " ", text.lower()).strip()
-
-
 def _tokenize(text: str) -> List[str]:
     return [token for token in _normalize(text).split() if token]
 
@@ -173,11 +168,10 @@ def reserve_hold(
 
     book = matches[0]
     state = load_state()
-    holds = state.get("holds", [])
-    for hold in holds:
+    index = hold_index(state)
+    for hold in index.by_student.get(resolved_student_id, []):
         if (
-            hold.get("student_id") == resolved_student_id
-            and hold.get("book_id") == book.book_id
+            hold.get("book_id") == book.book_id
             and hold.get("status") in {"Requested", "Ready"}
         ):
             hold_copy = dict(hold)
@@ -192,7 +186,7 @@ def reserve_hold(
                 "matches": [],
             }
 
-    hold_id = next_id("H", [hold.get("hold_id", "") for hold in holds])
+    hold_id = next_counter_id(state, "H", index.by_id)
     status = "Ready" if book.availability == "Available" else "Requested"
     now = datetime.now(timezone.utc)
     hold = {
@@ -201,11 +195,10 @@ def reserve_hold(
         "book_id": book.book_id,
         "status": status,
         "notes": notes or "",
-        "created_at": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "expires_at": (now + timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "created_at": iso_timestamp(now),
+        "expires_at": iso_timestamp(now + timedelta(days=7)),
     }
-    holds.append(hold)
-    state["holds"] = holds
+    add_hold(state, hold)
     save_state(state)
     hold_copy = dict(hold)
     hold_copy["book"] = asdict(book)
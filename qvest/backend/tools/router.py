@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from dataclasses import asdict, dataclass
-from typing import Any, Callable, Dict, List, Literal
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Literal
 
 from .availability import availability_requested, list_available_books
 from .holds import hold_requested, reserve_hold
@@ -228,6 +229,23 @@ def action_detect(name: str, message: str) -> bool:
     return bool(detect(message))
 
 
+@lru_cache(maxsize=1024)
+def _detected_actions(message: str) -> FrozenSet[str]:
+    # Detectors are pure functions of the text, and chat history texts are
+    # re-checked on later turns, so classify each message once.
+    return frozenset(name for name in _ACTION_REGISTRY if action_detect(name, message))
+
+
+def detect_actions(message: str, names: Iterable[str] | None = None) -> set[str]:
+    """Return the requested actions whose detectors fire on message."""
+    if not message:
+        return set()
+    hits = _detected_actions(message)
+    if names is None:
+        return set(hits)
+    return {name for name in names if name in hits}
+
+
 def signal_detect(name: str, message: str) -> bool:
     tool = _SIGNAL_REGISTRY.get(name)
     if not tool:
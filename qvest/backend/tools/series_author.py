@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import re
-from dataclasses import asdict
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..scoring import Catalog, SeriesAuthorIndex, normalize_text as _normalize
 
 
 SERIES_AUTHOR_RE = re.compile(
@@ -13,6 +14,7 @@ SERIES_AUTHOR_RE = re.compile(
     r")\b",
     re.IGNORECASE,
 )
+_BY_AUTHOR_RE = re.compile(r"\bby\s+([a-zA-Z .'-]{3,})")
 
 
 def series_author_requested(message: str) -> bool:
@@ -21,88 +23,37 @@ def series_author_requested(message: str) -> bool:
     return bool(SERIES_AUTHOR_RE.search(message))
 
 
-def _normalize(text: str) -> str:
-    if not text:
-        return ""
-    return re.sub(r"[^a-z0-9\s-]", " ", text.lower()).strip()
-
-
-def _book_year(book: Any) -> int:
-    value = getattr(book, "publication_year", None)
-    if value is None and isinstance(book, dict):
-        value = book.get("publication_year")
-    if not value:
-        return 0
-    try:
-        return int(str(value))
-    except ValueError:
-        return 0
+def _longest_in(text: str, pairs: Tuple[Tuple[str, Any], ...]) -> Optional[Any]:
+    for norm, value in pairs:
+        if norm in text:
+            return value
+    return None
 
 
-def _match_title(message: str, books: Dict[str, Any]) -> Optional[Any]:
-    text = _normalize(message)
-    best: Tuple[int, Any] | None = None
-    for book in books.values():
-        title = getattr(book, "title", "")
-        title_norm = _normalize(title)
-        if title_norm and title_norm in text:
-            score = len(title_norm)
-            if best is None or score > best[0]:
-                best = (score, book)
-    return best[1] if best else None
-
-
-def _match_series(message: str, series_list: Iterable[str]) -> Optional[str]:
-    text = _normalize(message)
-    best: Tuple[int, str] | None = None
-    for series in series_list:
-        series_norm = _normalize(series)
-        if series_norm and series_norm in text:
-            score = len(series_norm)
-            if best is None or score > best[0]:
-                best = (score, series)
-    return best[1] if best else None
-
+def _match_author(message: str, text: str, index: SeriesAuthorIndex) -> Optional[str]:
+    author = _longest_in(text, index.author_names)
+    if author:
+        return author
 
-def _match_author(message: str, authors: Iterable[str]) -> Optional[str]:
-    text = _normalize(message)
-    best: Tuple[int, str] | None = None
-    for author in authors:
-        author_norm = _normalize(author)
-        if author_norm and author_norm in text:
-            score = len(author_norm)
-            if best is None or score > best[0]:
-                best = (score, author)
-    if best:
-        return best[1]
-
-    by_match = re.search(r"\bby\s+([a-zA-Z .'-]{3,})", message or "")
+    by_match = _BY_AUTHOR_RE.search(message or "")
     if not by_match:
         return None
     fragment = _normalize(by_match.group(1))
     if not fragment:
         return None
-    for author in authors:
-        author_norm = _normalize(author)
+    for author_norm, author in index.author_names:
         if fragment in author_norm:
-            score = len(author_norm)
-            if best is None or score > best[0]:
-                best = (score, author)
-    return best[1] if best else None
+            return author
+    return None
 
 
 def _series_books(
-    books: Dict[str, Any],
+    index: SeriesAuthorIndex,
+    book_dicts: Dict[str, Dict[str, Any]],
     series: str,
     target_id: str | None,
 ) -> List[Dict[str, Any]]:
-    series_norm = _normalize(series)
-    candidates = [
-        book
-        for book in books.values()
-        if _normalize(getattr(book, "series", "")) == series_norm
-    ]
-    candidates.sort(key=lambda book: (_book_year(book), getattr(book, "title", "")))
+    candidates = list(index.by_series.get(_normalize(series), ()))
     if target_id:
         for idx, book in enumerate(candidates):
             if getattr(book, "book_id", "") == target_id:
@@ -111,7 +62,7 @@ def _series_books(
                 candidates = after + before
                 break
     results = [
-        asdict(book)
+        book_dicts[book.book_id]
         for book in candidates
         if not target_id or getattr(book, "book_id", "") != target_id
     ]
@@ -119,19 +70,14 @@ def _series_books(
 
 
 def _author_books(
-    books: Dict[str, Any],
+    index: SeriesAuthorIndex,
+    book_dicts: Dict[str, Dict[str, Any]],
     author: str,
     target_id: str | None,
 ) -> List[Dict[str, Any]]:
-    author_norm = _normalize(author)
-    candidates = [
-        book
-        for book in books.values()
-        if _normalize(getattr(book, "author", "")) == author_norm
-    ]
-    candidates.sort(key=lambda book: (-_book_year(book), getattr(book, "title", "")))
+    candidates = index.by_author.get(_normalize(author), ())
     results = [
-        asdict(book)
+        book_dicts[book.book_id]
         for book in candidates
         if not target_id or getattr(book, "book_id", "") != target_id
     ]
@@ -140,7 +86,7 @@ def _author_books(
 
 def find_series_author_matches(
     *,
-    books: Dict[str, Any],
+    catalog: Catalog,
     message: str,
     limit: int = 6,
 ) -> Dict[str, Any]:
@@ -156,18 +102,11 @@ def find_series_author_matches(
             "total_results": 0,
         }
 
-    target_book = _match_title(message, books)
+    index = catalog.series_author
+    book_dicts = catalog.dicts
+    text = _normalize(message)
+    target_book = _longest_in(text, index.titles)
     target_id = getattr(target_book, "book_id", None) if target_book else None
-    series_list = {
-        getattr(book, "series", "")
-        for book in books.values()
-        if getattr(book, "series", "")
-    }
-    author_list = {
-        getattr(book, "author", "")
-        for book in books.values()
-        if getattr(book, "author", "")
-    }
 
     mode = None
     match_source = None
@@ -181,24 +120,24 @@ def find_series_author_matches(
         author = getattr(target_book, "author", "") or None
         if series:
             mode = "series"
-            results = _series_books(books, series, target_id)
+            results = _series_books(index, book_dicts, series, target_id)
         if not results and author:
             mode = "author"
-            results = _author_books(books, author, target_id)
+            results = _author_books(index, book_dicts, author, target_id)
     if not results:
-        series_match = _match_series(message, series_list)
+        series_match = _longest_in(text, index.series_names)
         if series_match:
             mode = "series"
             match_source = "series"
             series = series_match
-            results = _series_books(books, series, target_id)
+            results = _series_books(index, book_dicts, series, target_id)
     if not results:
-        author_match = _match_author(message, author_list)
+        author_match = _match_author(message, text, index)
         if author_match:
             mode = "author"
             match_source = "author"
             author = author_match
-            results = _author_books(books, author, target_id)
+            results = _author_books(index, book_dicts, author, target_id)
 
     return {
         "mode": mode,
@@ -206,7 +145,7 @@ def find_series_author_matches(
         "query": series or author or (getattr(target_book, "title", None) if target_book else None),
         "series": series,
         "author": author,
-        "target_book": asdict(target_book) if target_book else None,
+        "target_book": book_dicts[target_book.book_id] if target_book else None,
         "results": results[:limit],
         "total_results": len(results),
     }
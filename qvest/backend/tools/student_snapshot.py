@@ -3,10 +3,11 @@ from __future__ import annotations
 import re
 from collections import Counter
 from dataclasses import asdict
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import Any, Dict, Iterable, List, Tuple
 
 from ..agent_state import load_state
+from ..agents.utils import now_iso
 
 
 SNAPSHOT_RE = re.compile(
@@ -33,10 +34,6 @@ def _parse_date(value: str) -> datetime | None:
         return None
 
 
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-
 def build_student_snapshot(
     *,
     books: Dict[str, Any],
@@ -52,7 +49,7 @@ def build_student_snapshot(
             "student": None,
             "onboarding_profile": None,
             "stats": {},
-            "generated_at": _now_iso(),
+            "generated_at": now_iso(),
             "error": "Student not found",
         }
 
@@ -144,5 +141,5 @@ def build_student_snapshot(
         "student": student,
         "onboarding_profile": profile,
         "stats": stats,
-        "generated_at": _now_iso(),
+        "generated_at": now_iso(),
     }
@@ -42,6 +42,7 @@ function addMessage(text, sender = "user") {
   bubble.textContent = text;
   chatWindow.appendChild(bubble);
   chatWindow.scrollTop = chatWindow.scrollHeight;
+  return bubble;
 }
 
 function setSessionId(value) {
@@ -85,9 +86,19 @@ function updateStudentStatus() {
     : "Using student: none";
 }
 
-async function fetchResponse(prompt) {
+function parseEvent(frame) {
+  let type = "message";
+  let data = "";
+  frame.split("\n").forEach((line) => {
+    if (line.startsWith("event:")) type = line.slice(6).trim();
+    else if (line.startsWith("data:")) data += line.slice(5).trim();
+  });
+  return { type, data: data ? JSON.parse(data) : null };
+}
+
+async function fetchResponse(prompt, onDelta) {
   ensureSessionId();
-  const response = await fetch(`${API_BASE}/chat`, {
+  const response = await fetch(`${API_BASE}/chat/stream`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({
@@ -102,7 +113,36 @@ async function fetchResponse(prompt) {
     throw new Error(detail || "Chat request failed");
   }
 
-  const data = await response.json();
+  // Server-sent events: "delta" frames carry reply text, "done" the full result,
+  // "error" the detail of a turn that failed mid-stream.
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let streamed = "";
+  let data = null;
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const event = parseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      if (event.type === "delta") {
+        streamed += event.data.text;
+        onDelta(streamed);
+      } else if (event.type === "done") {
+        data = event.data;
+      } else if (event.type === "error") {
+        throw new Error(event.data.detail || "Chat request failed");
+      }
+      boundary = buffer.indexOf("\n\n");
+    }
+  }
+  if (!data) {
+    throw new Error("Chat stream ended early");
+  }
+
   if (data.session_id && data.session_id !== chatSessionId) {
     setSessionId(data.session_id);
   }
@@ -123,10 +163,19 @@ function sendMessage() {
   }
   addMessage(text, "user");
   chatInput.value = "";
-  fetchResponse(text)
-    .then((reply) => addMessage(reply, "bot"))
+  let bubble = null;
+  const showReply = (reply) => {
+    if (!bubble) {
+      bubble = addMessage(reply, "bot");
+      return;
+    }
+    bubble.textContent = reply;
+    chatWindow.scrollTop = chatWindow.scrollHeight;
+  };
+  fetchResponse(text, showReply)
+    .then(showReply)
     .catch((error) => {
-      addMessage(`Error: ${error.message}`, "bot");
+      showReply(`Error: ${error.message}`);
     });
 }
 